@@ -1,5 +1,9 @@
-from utils.graph_utils import get_all_user_graphs, get_all_twitter_user_graphs, get_all_sentiment_user_graphs, get_all_twitter_sentiment_user_graphs
-from utils.fsm_utils import gspan, moss, igraph_to_gspan, igraph_to_nel, gspan_to_igraph, nel_to_igraph
+from utils.graph_utils import HashtagCorpus, get_all_twitter_user_graphs, get_all_twitter_sentiment_user_graphs, get_file_hash
+from utils.fsm_utils import gspan_job, moss_job, run_mining_jobs, is_job_up_to_date, get_job_patterns_path, get_total_memory, write_gspan, write_nel, write_if_changed, \
+    read_gspan_patterns, read_nel_patterns, read_checkpoint, get_graphs_fingerprint
+from utils.motif_utils import MotifOccurrenceEngine, count_null_model_occurrences
+from utils.census_utils import get_census_matrices, get_null_model_census, get_census_forms, align_census, save_census, iter_census_significance
+from utils.file_utils import atomic_write
 import igraph as ig
 import os
 
@@ -10,12 +14,13 @@ if __name__ == '__main__':
 
     # load and preprocess data
     print('Loading graphs...')
-    graphs = get_all_user_graphs()
+    corpus = HashtagCorpus()  # each hashtag's edges are parsed once and shared by both views
+    graphs = corpus.user_graphs()
     graphs = [g.simplify() for g in graphs]  # remove self loops and multi-edges for computational efficiency
     lccs = [g.components(mode='weak').giant() for g in graphs]
     
     # sentiment graphs
-    sgraphs = get_all_sentiment_user_graphs()
+    sgraphs = corpus.sentiment_user_graphs()
     sgraphs = [g.simplify(multiple=False) for g in sgraphs]
     slccs = [g.components(mode='weak').giant() for g in sgraphs]
     
@@ -29,25 +34,30 @@ if __name__ == '__main__':
     stwitter_graphs = [g.simplify(multiple=False) for g in stwitter_graphs]
     stwitter_lccs = [g.components(mode='weak').giant() for g in stwitter_graphs]
 
-    # create random graphs for comparison
+    # random graphs for comparison, generated batch by batch from seeds while motifs are counted in them
     BOOTSTRAPS = 10
-    confs = [
-        ig.Graph.Degree_Sequence(g.degree(mode='in'), g.degree(mode='out')).simplify()
-        for g in graphs for _ in range(BOOTSTRAPS)
-    ]
-    conf_lccs = [
-        ig.Graph.Degree_Sequence(g.degree(mode='in'), g.degree(mode='out')).simplify()
-        for g in lccs for _ in range(BOOTSTRAPS)
-    ]
-    ers = [
-        ig.Graph.Erdos_Renyi(n=g.vcount(), m=g.ecount(), directed=True).simplify(multiple=False)
-        for g in graphs for _ in range(BOOTSTRAPS)
-    ]
-    er_lccs = [
-        ig.Graph.Erdos_Renyi(n=g.vcount(), m=g.ecount(), directed=True).simplify(multiple=False)
-        for g in lccs for _ in range(BOOTSTRAPS)
-    ]
-    
+    NULL_MODEL_SEED = 42
+
+    # mining budget: moss heap per job in GB, memory of all concurrent jobs in bytes (a share of this machine's, or unlimited
+    # where it is unknown), and seconds per job
+    MOSS_HEAP_SIZE = 8
+    MINING_MEMORY_FRACTION = 0.75
+    total_memory = get_total_memory()
+    MINING_MEMORY_BUDGET = int(total_memory * MINING_MEMORY_FRACTION) if total_memory is not None else None
+    MINING_TIMEOUT = 24 * 60 * 60
+
+    # processes matching motifs against the hashtag, twitter and null model graphs
+    MOTIF_WORKERS = os.cpu_count()
+
+    # vertex counts of the directed motifs counted natively in every graph, up to the -n4 limit of the MoSS runs
+    CENSUS_SIZES = [3, 4]
+
+    # null models per graph behind the motif z-scores and p-values
+    SIGNIFICANCE_SAMPLES = 500
+
+    # motifs analysed between two appends to the checkpoint of a key, at most this many are repeated after a crash
+    MOTIF_CHECKPOINT_SIZE = 64
+
     graph_dict = {
         'graph': graphs,
         'lcc': lccs,
@@ -56,75 +66,57 @@ if __name__ == '__main__':
         'twitter_graph': twitter_graphs,
         'twitter_lcc': twitter_lccs,
         'twitter_sentiment_graph': stwitter_graphs,
-        'twitter_sentiment_lcc': stwitter_lccs,
-        'conf_graph': confs,
-        'conf_lcc': conf_lccs,
-        'er_graph': ers,
-        'er_lcc': er_lccs
+        'twitter_sentiment_lcc': stwitter_lccs
+    }
+    # graphs whose null models motifs are compared against: degree-preserving edge swaps (conf) and Erdos-Renyi (er)
+    null_model_dict = {
+        'graph': graphs,
+        'lcc': lccs
     }
     graphs_to_mine = ['graph', 'lcc', 'sentiment_graph', 'sentiment_lcc']
 
-    # convert to gspan and nel format
+    # convert to gspan and nel format, files whose graphs did not change keep their modification time
     for key in graphs_to_mine:
         value = graph_dict[key]
-        gspan_content = igraph_to_gspan(value)
-        nel = igraph_to_nel(value)
-        with open(f'../data/fsm/graphs/{key}.gspan', 'w') as f:
-            f.write(gspan_content)
-        with open(f'../data/fsm/graphs/{key}.nel', 'w') as f:
-            f.write(nel)
-
-    # perform frequent subgraph mining
-    print('Mining frequent undirected subgraphs...')
-    for key in graphs_to_mine:
-        print(f'\t Mining {key}...')
-        # run gspan - ./gSpan6/gSpan -f ../data/fsm/graphs/{key}.gspan -s 0.6 -o -i
-        filepath = f'../data/fsm/graphs/{key}.gspan'
-        gspan(filepath, support=0.6, verbose=True)
+        write_if_changed(f'../data/fsm/graphs/{key}.gspan', write_gspan, value)
+        write_if_changed(f'../data/fsm/graphs/{key}.nel', write_nel, value)
 
-    print('Mining frequent directed subgraphs...')
-    for key in graphs_to_mine:
-        print(f'\t Mining {key}...')
-        # run moss - java -Xmx6g -cp dmoss/moss.jar moss.Miner -inel -onel -x -D -m2 -n4 -s33 -C -A ../data/fsm/graphs/{key}.nel ../data/fsm/subgraphs/{key}.nel.moss
-        filepath = f'../data/fsm/graphs/{key}.nel'
-        moss(filepath, support=33, heap_size=8, directed=True, verbose=True)
+    # perform frequent subgraph mining, all gspan and moss runs at once within the core and memory budget
+    print('Mining frequent undirected and directed subgraphs...')
+    jobs = [gspan_job(f'../data/fsm/graphs/{key}.gspan', support=0.6) for key in graphs_to_mine]
+    jobs += [moss_job(f'../data/fsm/graphs/{key}.nel', support=33, heap_size=MOSS_HEAP_SIZE, directed=True) for key in graphs_to_mine]
+    # patterns newer than their input graphs, and mined with the same command, are mined already
+    up_to_date = [is_job_up_to_date(job) for job in jobs]
+    skipped_jobs = [job for job, done in zip(jobs, up_to_date) if done]
+    jobs = [job for job, done in zip(jobs, up_to_date) if not done]
+    for job in skipped_jobs:
+        print(f'\t Skipping {job["name"]}: {get_job_patterns_path(job)} is up to date')
+    results = run_mining_jobs(jobs, memory_budget=MINING_MEMORY_BUDGET, timeout=MINING_TIMEOUT, verbose=True)
+    for result in results:
+        print(f'\t Mined {result["name"]}: {result["patterns"]} patterns in {result["seconds"]:.1f}s')
 
     # analyse significant motifs
-    def analyze_motif(motif: ig.Graph, graphs: list, twitter: list, use_edge_colors: bool, confs: list = None, ers: list = None) -> dict:
+    def analyze_motif(motif: ig.Graph, occurrences: dict, graphs: list, twitter: list, conf_count: int = None, er_count: int = None) -> dict:
         fsm_support = motif['support']
-        if use_edge_colors:
-            motif_edge_color = 'sentiment_value'
-            graphs_edge_color = 'stitcher_sentiment_value'
-            twitter_edge_color = 'sentiment_value'
-        else:
-            motif_edge_color = None
-            graphs_edge_color = None
-            twitter_edge_color = None
-            
-        occurrences = [g.subisomorphic_vf2(motif, edge_color1=graphs_edge_color, edge_color2=motif_edge_color) for g in graphs]
-        indeces = [i for i, o in enumerate(occurrences) if o]
-        graph_labels = [g['name'] for g, o in zip(graphs, occurrences) if o]
-        graph_support = sum(occurrences)
-
-        twitter_occurences = [g.subisomorphic_vf2(motif, edge_color1=twitter_edge_color, edge_color2=motif_edge_color) for g in twitter]
+
+        graph_occurrences = occurrences['graphs']
+        indeces = [i for i, o in enumerate(graph_occurrences) if o]
+        graph_labels = [g['name'] for g, o in zip(graphs, graph_occurrences) if o]
+        graph_support = sum(graph_occurrences)
+
+        twitter_occurences = occurrences['twitter']
         twitter_indeces = [i for i, o in enumerate(twitter_occurences) if o]
         twitter_labels = [g['name'] for g, o in zip(twitter, twitter_occurences) if o]
         twitter_support = sum(twitter_occurences)
 
-        if confs is not None:
-            conf_support = sum([1 for g in confs if g.subisomorphic_vf2(motif)]) / BOOTSTRAPS
-        else:
-            conf_support = None
-        if ers is not None:
-            er_support = sum([1 for g in ers if g.subisomorphic_vf2(motif)]) / BOOTSTRAPS
-        else:
-            er_support = None
+        conf_support = conf_count / BOOTSTRAPS if conf_count is not None else None
+        er_support = er_count / BOOTSTRAPS if er_count is not None else None
 
         return {
             'vertices': [v.index for v in motif.vs],
             'edges': [(e.source, e.target) for e in motif.es],
             'edge_colors': [e['sentiment_value'] for e in motif.es] if motif.es.attributes() else None,
-            'graph_occurrences': occurrences,
+            'graph_occurrences': graph_occurrences,
             'graph_indeces': indeces,
             'graph_labels': graph_labels,
             'graph_support': graph_support,
@@ -137,27 +129,93 @@ if __name__ == '__main__':
             'er_support': er_support
         }
 
+    def get_checkpoint_header(patterns_path: str, graphs: list, twitter: list, use_edge_colors: bool, null_model_graphs: list, undirected: bool) -> dict:
+        # everything the records of a checkpoint depend on, a checkpoint with another header is started over
+        return {'checkpoint': {
+            'patterns': get_file_hash(patterns_path),
+            'graphs': get_graphs_fingerprint(graphs, 'stitcher_sentiment_value' if use_edge_colors else None),
+            'twitter': get_graphs_fingerprint(twitter, 'sentiment_value' if use_edge_colors else None),
+            'null_model_graphs': get_graphs_fingerprint(null_model_graphs) if null_model_graphs is not None else None,
+            'bootstraps': BOOTSTRAPS,
+            'seed': NULL_MODEL_SEED,
+            'undirected': undirected
+        }}
+
+    def analyze_motifs(motifs: list, graphs: list, twitter: list, use_edge_colors: bool, checkpoint: str, checkpoint_header: dict,
+                       null_model_graphs: list = None, undirected: bool = False) -> list:
+        """
+        Analyses motifs MOTIF_CHECKPOINT_SIZE at a time and appends their records, with their motif_index, to the JSONL
+        file checkpoint once a chunk is done. The first line of the checkpoint is checkpoint_header, see get_checkpoint_header,
+        and the null model counts of the remaining motifs follow it as one null_counts line before their records.
+        Motifs that already have a record in a checkpoint with the same header are not analysed again, so checkpoints
+        are kept, and a rerun with unchanged inputs reads every record from them.
+        Returns the records in the order of motifs.
+        """
+        records, conf_counts, er_counts = {}, {}, {}
+        checkpointed = read_checkpoint(checkpoint)
+        if checkpointed[:1] == [json.loads(json.dumps(checkpoint_header))]:
+            for record in checkpointed[1:]:
+                if 'null_counts' in record:
+                    null_counts = record['null_counts']
+                    conf_counts.update(zip(null_counts['indices'], null_counts['conf']))
+                    er_counts.update(zip(null_counts['indices'], null_counts['er']))
+                else:
+                    records[record.pop('motif_index')] = record
+            print(f'\t\t Resuming with {len(records)} motifs from {checkpoint}...')
+        else:
+            # no checkpoint, or one of other patterns, graphs or null model settings
+            with atomic_write(checkpoint) as temporary, open(temporary, 'w') as f:
+                f.write(json.dumps(checkpoint_header) + '\n')
+        remaining = [i for i in range(len(motifs)) if i not in records]
+        if not remaining:
+            return [records[i] for i in range(len(motifs))]
+
+        # null model graphs are always matched without edge colors, all uncounted motifs at once so every null model is generated once
+        uncounted = [i for i in remaining if i not in conf_counts] if null_model_graphs is not None else []
+        if uncounted:
+            uncounted_motifs = [motifs[i] for i in uncounted]
+            conf_counts.update(zip(uncounted, count_null_model_occurrences(uncounted_motifs, null_model_graphs, 'edge_swap', BOOTSTRAPS, seed=NULL_MODEL_SEED,
+                                                                           workers=MOTIF_WORKERS, undirected=undirected)))
+            er_counts.update(zip(uncounted, count_null_model_occurrences(uncounted_motifs, null_model_graphs, 'erdos_renyi', BOOTSTRAPS, seed=NULL_MODEL_SEED,
+                                                                         workers=MOTIF_WORKERS, undirected=undirected)))
+            with open(checkpoint, 'a') as f:
+                f.write(json.dumps({'null_counts': {'indices': uncounted, 'conf': [conf_counts[i] for i in uncounted],
+                                                    'er': [er_counts[i] for i in uncounted]}}) + '\n')
+
+        targets = {
+            'graphs': (graphs, 'stitcher_sentiment_value' if use_edge_colors else None),
+            'twitter': (twitter, 'sentiment_value' if use_edge_colors else None)
+        }
+        # one engine for all chunks, so containment results carry over from chunk to chunk
+        with MotifOccurrenceEngine(targets, workers=MOTIF_WORKERS) as engine, open(checkpoint, 'a') as f:
+            for start in range(0, len(remaining), MOTIF_CHECKPOINT_SIZE):
+                indices = remaining[start:start + MOTIF_CHECKPOINT_SIZE]
+                chunk = [motifs[i] for i in indices]
+                occurrences = engine.occurrences(chunk, 'sentiment_value' if use_edge_colors else None)
+                for i, motif, motif_occurrences in zip(indices, chunk, occurrences):
+                    records[i] = analyze_motif(motif, motif_occurrences, graphs, twitter, conf_counts.get(i), er_counts.get(i))
+                    f.write(json.dumps({'motif_index': i, **records[i]}) + '\n')
+                f.flush()
+                print(f'\t\t Analysed {len(records)} of {len(motifs)} motifs')
+            print(f'\t\t Skipped {engine.skipped + engine.inferred} of {engine.pairs} VF2 checks ({engine.skip_rate():.1%}), '
+                  f'{engine.skipped} by graph invariants and {engine.inferred} by sub- and super-patterns')
+        return [records[i] for i in range(len(motifs))]
+
     print('Analysing significant motifs...')
     for key in graphs_to_mine:
         print(f'\t Analysing {key}...')
         use_edge_colors = 'sentiment' in key
-        data = []
-        with open(f'../data/fsm/subgraphs/{key}.gspan.fp') as f:
-            gspan_content = f.read()
-        motifs = gspan_to_igraph(gspan_content)
+        patterns_path = f'../data/fsm/subgraphs/{key}.gspan.fp'
+        motifs = list(read_gspan_patterns(patterns_path))
         graphs = graph_dict[key]
         graphs = [g.as_undirected(mode='each') for g in graphs]
         twitter = graph_dict[f'twitter_{key}']
         twitter = [g.as_undirected(mode='each') for g in twitter]
-        confs = graph_dict.get(f'conf_{key}', None)
-        confs = [g.as_undirected(mode='each') for g in confs] if confs is not None else None
-        ers = graph_dict.get(f'er_{key}', None)
-        ers = [g.as_undirected(mode='each') for g in ers] if ers is not None else None
 
-        for i, motif in enumerate(motifs):
-            print(f'\t\t Analysing motif {i}...')
-            motif_data = analyze_motif(motif, graphs, twitter, use_edge_colors, confs, ers)
-            data.append(motif_data)
+        print(f'\t\t Analysing {len(motifs)} motifs...')
+        checkpoint = f'../data/fsm/subgraph_data/{key}.jsonl'
+        header = get_checkpoint_header(patterns_path, graphs, twitter, use_edge_colors, null_model_dict.get(key), undirected=True)
+        data = analyze_motifs(motifs, graphs, twitter, use_edge_colors, checkpoint, header, null_model_dict.get(key), undirected=True)
 
         with open(f'../data/fsm/subgraph_data/{key}.json', 'w') as f:
             json.dump(data, f, indent=2)
@@ -167,19 +225,48 @@ if __name__ == '__main__':
     for key in graphs_to_mine:
         print(f'\t Analysing {key}...')
         use_edge_colors = 'sentiment' in key
-        data = []
-        with open(f'../data/fsm/subgraphs/{key}.nel.moss') as f:
-            nel = f.read()
-        motifs = nel_to_igraph(nel)
+        patterns_path = f'../data/fsm/subgraphs/{key}.nel.moss'
+        motifs = list(read_nel_patterns(patterns_path))
         graphs = graph_dict[key]
         twitter = graph_dict[f'twitter_{key}']
-        confs = graph_dict.get(f'conf_{key}', None)
-        ers = graph_dict.get(f'er_{key}', None)
 
-        for i, motif in enumerate(motifs):
-            print(f'\t\t Analysing motif {i}...')
-            motif_data = analyze_motif(motif, graphs, twitter, use_edge_colors, confs, ers)
-            data.append(motif_data)
+        print(f'\t\t Analysing {len(motifs)} motifs...')
+        checkpoint = f'../data/fsm/subgraph_data/{key}_directed.jsonl'
+        header = get_checkpoint_header(patterns_path, graphs, twitter, use_edge_colors, null_model_dict.get(key), undirected=False)
+        data = analyze_motifs(motifs, graphs, twitter, use_edge_colors, checkpoint, header, null_model_dict.get(key))
 
         with open(f'../data/fsm/subgraph_data/{key}_directed.json', 'w') as f:
-            json.dump(data, f, indent=2)
\ No newline at end of file
+            json.dump(data, f, indent=2)
+
+    # count every directed 3- and 4-vertex motif natively, in the hashtag, twitter and null model graphs
+    print('Counting directed motif census...')
+    for key in graphs_to_mine:
+        use_edge_colors = 'sentiment' in key
+        for size in CENSUS_SIZES:
+            print(f'\t Counting {key} motifs with {size} vertices...')
+            targets = {
+                'graph': (graph_dict[key], 'stitcher_sentiment_value' if use_edge_colors else None),
+                'twitter': (graph_dict[f'twitter_{key}'], 'sentiment_value' if use_edge_colors else None)
+            }
+            census = [get_census_matrices(targets, size, workers=MOTIF_WORKERS)]
+            if key in null_model_dict:
+                # null models are uncolored, with a (graphs, bootstraps, forms) array per model
+                for name, model in [('conf', 'edge_swap'), ('er', 'erdos_renyi')]:
+                    null_census, null_forms = get_null_model_census(null_model_dict[key], model, BOOTSTRAPS, size, seed=NULL_MODEL_SEED, workers=MOTIF_WORKERS)
+                    census.append(({name: null_census}, null_forms))
+
+            # one column per motif form across all matrices
+            forms = get_census_forms([census_forms for _, census_forms in census])
+            matrices = {name: align_census(matrix, census_forms, forms) for census_matrices, census_forms in census for name, matrix in census_matrices.items()}
+            save_census(f'../data/fsm/census/{key}_{size}.npz', matrices, forms)
+
+    # motif z-scores and empirical p-values against large null ensembles, written per graph as soon as it is done
+    print('Testing directed motif significance...')
+    for key in null_model_dict:
+        for size in CENSUS_SIZES:
+            for name, model in [('conf', 'edge_swap'), ('er', 'erdos_renyi')]:
+                print(f'\t Testing {key} motifs with {size} vertices against {SIGNIFICANCE_SAMPLES} {name} null models per graph...')
+                with open(f'../data/fsm/subgraph_data/{key}_{name}_significance_{size}.jsonl', 'w') as f:
+                    for record in iter_census_significance(null_model_dict[key], model, SIGNIFICANCE_SAMPLES, size, seed=NULL_MODEL_SEED, workers=MOTIF_WORKERS):
+                        f.write(json.dumps(record) + '\n')
+                        f.flush()
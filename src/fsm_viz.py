@@ -1,4 +1,4 @@
-from utils.fsm_utils import gspan_to_igraph, nel_to_igraph, json_to_igraph
+from utils.fsm_utils import read_gspan_patterns, read_nel_patterns, json_to_igraph
 import igraph as ig
 import json
 from collections import Counter, defaultdict
@@ -170,12 +170,11 @@ if __name__ == '__main__':
         directed = 'directed' in filepath
         graphs = json_to_igraph(data, directed=directed)
     elif '.gspan' in filepath or '.nel' in filepath:
-        with open(f'../data/fsm/subgraphs/{filepath}', 'r') as f:
-            content = f.read()
+        # patterns below the minimum support or with a single vertex are skipped while reading
         if '.gspan' in filepath:
-            graphs = gspan_to_igraph(content)
+            graphs = list(read_gspan_patterns(f'../data/fsm/subgraphs/{filepath}', min_support=min_support, min_vertices=2))
         elif '.nel' in filepath:
-            graphs = nel_to_igraph(content)
+            graphs = list(read_nel_patterns(f'../data/fsm/subgraphs/{filepath}', min_support=min_support, min_vertices=2))
     else:
         print("File format not supported")
         exit(1)
@@ -10,6 +10,8 @@ from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
 from umap import UMAP
 
+from utils.graph_utils import load_edges_cached
+from utils.null_model_utils import EdgeSwapRewirer
 
 from sklearn.metrics import silhouette_score, davies_bouldin_score  # Import scoring functions
 
@@ -20,17 +22,8 @@ def construct_graphs(hashtags, directed, lcc_only=False):
 
     for hashtag in hashtags:
         names.append(hashtag)
-        with open(f'../data/hashtags/edges/{hashtag}_edges.txt', 'r') as f:
-            edges = f.readlines()
-
-        users = []
-        for edge in edges:
-            u, v = edge.strip().split(',')
-            if 'None' in v:
-                continue
-            u_user = u.split('/')[-3]
-            v_user = v.split('/')[-3]
-            users.append((u_user, v_user))
+        edges = load_edges_cached(f'../data/hashtags/edges/{hashtag}_edges.txt')
+        users = list(zip(edges['stitcher_user'], edges['stitchee_user']))
 
         all_users = set(user for edge in users for user in edge)
         user_to_id = {user: i for i, user in enumerate(all_users)}
@@ -56,32 +49,24 @@ def construct_graphs(hashtags, directed, lcc_only=False):
 
     return names, graphs
 
-def construct_configuration_models(names, graphs, directed):
-    """Constructs configuration model graphs based on the LCC of the current graphs."""
+def construct_configuration_models(names, graphs, directed, seed=42):
+    """Constructs degree-preserving null model graphs by rewiring the current graphs with edge swaps."""
     print("Creating configuration model graphs")
     config_names = []
     config_graphs = []
 
-    for name, G in zip(names, graphs):
+    for i, (name, G) in enumerate(zip(names, graphs)):
         config_name = f'{name}_config'
         config_names.append(config_name)
 
-        if directed:
-            # For directed graphs, use both in-degree and out-degree sequences
-            in_degrees = [d for n, d in G.in_degree()]
-            out_degrees = [d for n, d in G.out_degree()]
-            CM = nx.directed_configuration_model(in_degrees, out_degrees)
-            # Convert to DiGraph and remove self-loops and parallel edges
-            CM = nx.DiGraph(CM)
-            #CM.remove_edges_from(nx.selfloop_edges(CM))
-        else:
-            degrees = [d for n, d in G.degree()]
-            CM = nx.configuration_model(degrees)
-            # Convert to Graph and remove self-loops and parallel edges
-            CM = nx.Graph(CM)
-            #CM.remove_edges_from(nx.selfloop_edges(CM))
+        # Rewire a copy of the graph, which keeps every (in- and out-) degree and any self-loops
+        G = nx.convert_node_labels_to_integers(G)
+        edges = np.array(list(G.edges()), dtype=np.int64).reshape(-1, 2)
+        rewirer = EdgeSwapRewirer({'n': G.number_of_nodes(), 'directed': directed, 'edges': edges}, seed=[seed, i])
 
-        CM = nx.convert_node_labels_to_integers(CM)
+        CM = nx.DiGraph() if directed else nx.Graph()
+        CM.add_nodes_from(range(G.number_of_nodes()))
+        CM.add_edges_from(rewirer.sample().get_edgelist())
         config_graphs.append(CM)
 
     return config_names, config_graphs
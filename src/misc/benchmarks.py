@@ -0,0 +1,592 @@
+# Benchmarks for the data loading and graph utilities.
+#
+# Usage (from src/):
+#   python misc/benchmarks.py BENCHMARK [BENCHMARK ...]
+#
+# Each benchmark compares an optimized function in utils against a reference
+# implementation kept here, and checks that both produce the same output.
+import itertools
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import json
+from collections import Counter
+
+import igraph as ig
+import numpy as np
+import pandas as pd
+from scipy.sparse import lil_matrix
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.graph_utils import HashtagCorpus, load_edges, load_edges_cached, get_sentiment_video_graph, get_sentiment_user_graph, get_video_graph, get_user_graph, sentiment_value_dict, load_sentiment, sentiment_columns, project_graph
+from utils.fsm_utils import write_gspan, write_nel, read_gspan_patterns, read_nel_patterns
+from utils.motif_utils import MotifOccurrenceEngine, get_canonical_form
+from utils.census_utils import motif_census
+
+EDGE_PATH = '../data/hashtags/edges/'
+
+
+def timeit(func, *args, repeats=5, **kwargs):
+    """Returns the best wall clock time of repeats calls and the last result."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def get_edge_files() -> list:
+    edge_files = [os.path.join(EDGE_PATH, file) for file in os.listdir(EDGE_PATH) if file.endswith('.txt')]
+    edge_files.sort()
+    return edge_files
+
+
+#####################
+#  Edge file parser #
+#####################
+
+def load_edges_reference(filepath: str) -> pd.DataFrame:
+    # original per-row implementation of utils.graph_utils.load_edges
+    edges = pd.read_csv(filepath, header=None)
+
+    edges.columns = ['stitcher_url', 'stitchee_url']
+    edges = edges[edges['stitcher_url'].str.contains('None') == False]
+    edges = edges[edges['stitchee_url'].str.contains('None') == False]
+
+    edges['stitcher'] = edges['stitcher_url'].apply(lambda x: x.split('/')[-1]).astype(np.int64)
+    edges['stitchee'] = edges['stitchee_url'].apply(lambda x: x.split('/')[-1]).astype(np.int64)
+
+    expression = re.compile(r'@[\w\d\.]+')
+    edges['stitcher_user'] = edges['stitcher_url'].apply(lambda x: re.findall(expression, x)[0])
+    edges['stitchee_user'] = edges['stitchee_url'].apply(lambda x: re.findall(expression, x)[0])
+
+    return edges
+
+
+def benchmark_load_edges(repeats: int = 5):
+    print('Benchmarking load_edges')
+    print(f'{"file":<28}{"rows":>8}{"reference (ms)":>16}{"vectorized (ms)":>17}{"speedup":>9}')
+    total_reference = total_vectorized = 0
+    for edge_file in get_edge_files():
+        t_reference, reference = timeit(load_edges_reference, edge_file, repeats=repeats)
+        t_vectorized, vectorized = timeit(load_edges, edge_file, repeats=repeats)
+
+        # outputs must agree up to dtypes, the vectorized parser no longer keeps the raw urls
+        columns = ['stitcher', 'stitchee', 'stitcher_user', 'stitchee_user']
+        pd.testing.assert_frame_equal(reference[columns].reset_index(drop=True), vectorized[columns].astype({'stitcher_user': str, 'stitchee_user': str}), check_dtype=False)
+
+        total_reference += t_reference
+        total_vectorized += t_vectorized
+        print(f'{os.path.basename(edge_file):<28}{len(vectorized):>8}{t_reference * 1000:>16.2f}{t_vectorized * 1000:>17.2f}{t_reference / t_vectorized:>8.1f}x')
+    print(f'{"total":<28}{"":>8}{total_reference * 1000:>16.2f}{total_vectorized * 1000:>17.2f}{total_reference / total_vectorized:>8.1f}x')
+
+
+def benchmark_edge_cache(repeats: int = 5):
+    print('Benchmarking load_edges_cached on the full corpus')
+    edge_files = get_edge_files()
+    cache_path = tempfile.mkdtemp()
+    try:
+        t_parse, _ = timeit(lambda: [load_edges(f) for f in edge_files], repeats=repeats)
+
+        # cold loads parse every file and write the cache, so start from an empty directory each time
+        t_cold = float('inf')
+        for _ in range(repeats):
+            shutil.rmtree(cache_path)
+            start = time.perf_counter()
+            for edge_file in edge_files:
+                load_edges_cached(edge_file, cache_path=cache_path)
+            t_cold = min(t_cold, time.perf_counter() - start)
+
+        t_warm, cached = timeit(lambda: [load_edges_cached(f, cache_path=cache_path) for f in edge_files], repeats=repeats)
+        for edge_file, edges in zip(edge_files, cached):
+            pd.testing.assert_frame_equal(load_edges(edge_file), edges)
+    finally:
+        shutil.rmtree(cache_path, ignore_errors=True)
+
+    print(f'{len(edge_files)} edge files, {sum(len(edges) for edges in cached)} edges')
+    print(f'{"parse only (ms)":<20}{t_parse * 1000:>10.2f}')
+    print(f'{"cold cache (ms)":<20}{t_cold * 1000:>10.2f}')
+    print(f'{"warm cache (ms)":<20}{t_warm * 1000:>10.2f}{t_parse / t_warm:>8.1f}x')
+
+
+########################
+#  Sentiment attachment #
+########################
+
+def get_sentiment_video_graph_reference(edges: pd.DataFrame, sentiment: pd.DataFrame, directed=True):
+    # original per-vertex implementation of utils.graph_utils.get_sentiment_video_graph
+    g = get_video_graph(edges, directed=directed)
+    sentiment['id'] = sentiment.apply(lambda x: x['video_id'] if x['stitchee_id'] == -1 else x['stitchee_id'], axis=1)
+    sentiment_dict = sentiment.set_index('id')['sentiment'].to_dict()
+    g.vs['sentiment'] = [sentiment_dict.get(v['name'], 'no transcription') for v in g.vs]
+    score_dict = sentiment.set_index('id')['compound'].to_dict()
+    g.vs['score'] = [score_dict.get(v['name'], None) for v in g.vs]
+    g.vs['sentiment_value'] = [sentiment_value_dict[s] for s in g.vs['sentiment']]
+    return g
+
+
+def get_sentiment_user_graph_reference(edges: pd.DataFrame, sentiment: pd.DataFrame, directed=True):
+    # original per-edge implementation of utils.graph_utils.get_sentiment_user_graph
+    g = get_user_graph(edges, directed=directed)
+    sentiment['id'] = sentiment.apply(lambda x: x['video_id'] if x['stitchee_id'] == -1 else x['stitchee_id'], axis=1)
+    sentiment_dict = sentiment.set_index('id')['sentiment'].to_dict()
+    g.es['stitcher_sentiment'] = [sentiment_dict.get(e['stitcher_id'], 'no transcription') for e in g.es]
+    g.es['stitchee_sentiment'] = [sentiment_dict.get(e['stitchee_id'], 'no transcription') for e in g.es]
+    g.es['stitcher_sentiment_value'] = [sentiment_value_dict[s] for s in g.es['stitcher_sentiment']]
+    g.es['stitchee_sentiment_value'] = [sentiment_value_dict[s] for s in g.es['stitchee_sentiment']]
+    score_dict = sentiment.set_index('id')['compound'].to_dict()
+    g.es['stitcher_score'] = [score_dict.get(e['stitcher_id'], None) for e in g.es]
+    g.es['stitchee_score'] = [score_dict.get(e['stitchee_id'], None) for e in g.es]
+    return g
+
+
+def assert_same_attributes(reference: list, vectorized: list):
+    # None and NaN are kept apart, NaN compares equal to NaN
+    assert len(reference) == len(vectorized)
+    for a, b in zip(reference, vectorized):
+        assert (a is None) == (b is None) and (a == b or a != a and b != b), (a, b)
+
+
+def benchmark_sentiment(repeats: int = 3):
+    print('Benchmarking sentiment attachment')
+    print('Times exclude building the graphs themselves, which both implementations share')
+    print(f'{"hashtag":<20}{"edges":>8}{"reference (ms)":>16}{"vectorized (ms)":>17}{"speedup":>9}')
+    corpus = HashtagCorpus()
+    total_reference = total_vectorized = 0
+    for hashtag in corpus.sentiment_hashtags:
+        edges = corpus.edges(hashtag)
+        sentiment = corpus.sentiment(hashtag)
+        t_reference, reference = timeit(lambda: (get_sentiment_video_graph_reference(edges, sentiment.copy()), get_sentiment_user_graph_reference(edges, sentiment.copy())), repeats=repeats)
+        t_vectorized, vectorized = timeit(lambda: (get_sentiment_video_graph(edges, sentiment), get_sentiment_user_graph(edges, sentiment)), repeats=repeats)
+        t_build, _ = timeit(lambda: (get_video_graph(edges), get_user_graph(edges)), repeats=repeats)
+        t_reference -= t_build
+        t_vectorized -= t_build
+
+        for attr in ['sentiment', 'score', 'sentiment_value']:
+            assert_same_attributes(reference[0].vs[attr], vectorized[0].vs[attr])
+        for attr in ['stitcher_sentiment', 'stitchee_sentiment', 'stitcher_sentiment_value', 'stitchee_sentiment_value', 'stitcher_score', 'stitchee_score']:
+            assert_same_attributes(reference[1].es[attr], vectorized[1].es[attr])
+
+        total_reference += t_reference
+        total_vectorized += t_vectorized
+        print(f'{hashtag:<20}{len(edges):>8}{t_reference * 1000:>16.2f}{t_vectorized * 1000:>17.2f}{t_reference / t_vectorized:>8.1f}x')
+    print(f'{"total":<20}{"":>8}{total_reference * 1000:>16.2f}{total_vectorized * 1000:>17.2f}{total_reference / total_vectorized:>8.1f}x')
+
+
+def load_sentiment_reference(filepath: str) -> pd.DataFrame:
+    # original implementation of utils.graph_utils.load_sentiment, which keeps every field
+    data = []
+    with open(filepath, 'r') as f:
+        for line in f:
+            line_data = json.loads(line)
+            line_data['stitchee_id'] = -1 if line_data['stitchee_id'] is None else line_data['stitchee_id']
+            line_data['pos'] = line_data['sentiment_scores']['pos'] if line_data['sentiment_scores'] is not None else None
+            line_data['neg'] = line_data['sentiment_scores']['neg'] if line_data['sentiment_scores'] is not None else None
+            line_data['neu'] = line_data['sentiment_scores']['neu'] if line_data['sentiment_scores'] is not None else None
+            line_data['compound'] = line_data['sentiment_scores']['compound'] if line_data['sentiment_scores'] is not None else None
+            data.append(line_data)
+    return pd.DataFrame(data)
+
+
+def peak_memory(func, *args, **kwargs):
+    """Returns the peak memory in bytes allocated by python during a single call."""
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_load_sentiment(repeats: int = 3):
+    print('Benchmarking load_sentiment')
+    print(f'{"file":<44}{"reference (ms)":>16}{"streaming (ms)":>16}{"reference (MB)":>16}{"streaming (MB)":>16}')
+    path = '../data/hashtags/transcriptions/'
+    files = sorted(os.path.join(path, file) for file in os.listdir(path) if file.endswith('.jsonl'))
+    total_reference = total_streaming = 0
+    for sentiment_file in files:
+        t_reference, reference = timeit(load_sentiment_reference, sentiment_file, repeats=repeats)
+        t_streaming, streaming = timeit(load_sentiment, sentiment_file, sentiment_columns, repeats=repeats)
+        pd.testing.assert_frame_equal(reference[sentiment_columns], streaming)
+        # every field is kept by default, with ids as int64 instead of the reference's inferred dtypes
+        pd.testing.assert_frame_equal(reference, load_sentiment(sentiment_file), check_dtype=False)
+
+        m_reference = peak_memory(load_sentiment_reference, sentiment_file)
+        m_streaming = peak_memory(load_sentiment, sentiment_file, sentiment_columns)
+        total_reference += t_reference
+        total_streaming += t_streaming
+        print(f'{os.path.basename(sentiment_file):<44}{t_reference * 1000:>16.2f}{t_streaming * 1000:>16.2f}{m_reference / 1e6:>16.2f}{m_streaming / 1e6:>16.2f}')
+    print(f'{"total":<44}{total_reference * 1000:>16.2f}{total_streaming * 1000:>16.2f}')
+
+
+def benchmark_parallel_load(repeats: int = 3):
+    print('Benchmarking parallel corpus loading')
+    print(f'{"workers":<10}{"user (ms)":>12}{"sentiment user (ms)":>22}{"speedup":>9}')
+    max_workers = os.cpu_count() or 1
+    worker_counts = sorted(set([1] + [2 ** i for i in range(1, max_workers.bit_length()) if 2 ** i <= max_workers] + [max_workers]))
+    baseline = None
+    for workers in worker_counts:
+        # a fresh corpus per run so every run parses its own edges
+        t_user, _ = timeit(lambda: HashtagCorpus().user_graphs(workers=workers), repeats=repeats)
+        t_sentiment, _ = timeit(lambda: HashtagCorpus().sentiment_user_graphs(workers=workers), repeats=repeats)
+        total = t_user + t_sentiment
+        baseline = baseline or total
+        print(f'{workers:<10}{t_user * 1000:>12.2f}{t_sentiment * 1000:>22.2f}{baseline / total:>8.1f}x')
+
+
+
+def project_graph_reference(G: ig.Graph) -> ig.Graph:
+    # original implementation of utils.graph_utils.project_graph
+    A = G.get_adjacency_sparse()
+    A_proj = A @ A.T
+    A_proj = lil_matrix(A_proj)
+    A_proj.setdiag(0)
+    A_proj = A_proj.tocsr()
+    return ig.Graph.Adjacency(A_proj, mode='undirected')
+
+
+def benchmark_project(repeats: int = 3, largest: int = 5, hub_size: int = 300):
+    print('Benchmarking project_graph on the largest hashtags')
+    print(f'{"graph":<28}{"edges":>10}{"reference (ms)":>16}{"chunked (ms)":>14}{"reference (MB)":>16}{"chunked (MB)":>14}')
+    graphs = []
+    for edge_file in sorted(get_edge_files(), key=os.path.getsize, reverse=True)[:largest]:
+        edges = load_edges(edge_file)
+        hashtag = os.path.basename(edge_file).replace('_edges.txt', '')
+        graphs += [(hashtag, get_video_graph(edges)), (hashtag + '-user', get_user_graph(edges))]
+
+    # a single stitchee with hub_size stitchers, which projects onto a clique
+    graphs.append((f'hub-{hub_size}', ig.Graph(n=hub_size + 1, edges=[(i, hub_size) for i in range(hub_size)], directed=True)))
+
+    for label, G in graphs:
+        t_reference, reference = timeit(project_graph_reference, G, repeats=repeats)
+        t_chunked, chunked = timeit(project_graph, G, repeats=repeats)
+        assert reference.get_edgelist() == chunked.get_edgelist()
+
+        m_reference = peak_memory(project_graph_reference, G)
+        m_chunked = peak_memory(project_graph, G)
+        print(f'{label:<28}{chunked.ecount():>10}{t_reference * 1000:>16.2f}{t_chunked * 1000:>14.2f}{m_reference / 1e6:>16.2f}{m_chunked / 1e6:>14.2f}')
+
+
+
+def igraph_to_gspan_reference(graphs: list) -> str:
+    # original implementation of utils.fsm_utils.igraph_to_gspan
+    output = ''
+    is_sentiment_graph = 'stitcher_sentiment' in graphs[0].es.attributes()
+    for i, g in enumerate(graphs):
+        if g.is_directed():
+            g = g.as_undirected(mode='each')
+        output += f't # {i}\n'
+        for v in g.vs:
+            output += f'v {v.index} 0\n'
+        for e in g.es:
+            sentiment = e['stitcher_sentiment_value'] if is_sentiment_graph else 0
+            output += f'e {e.source} {e.target} {sentiment}\n'
+    return output
+
+
+def igraph_to_nel_reference(graphs: list) -> str:
+    # original implementation of utils.fsm_utils.igraph_to_nel
+    output = ''
+    is_sentiment_graph = 'stitcher_sentiment' in graphs[0].es.attributes()
+    for i, g in enumerate(graphs):
+        for v in g.vs:
+            output += f'v {v.index + 1}\n'
+        for e in g.es:
+            sentiment = e['stitcher_sentiment_value'] if is_sentiment_graph else 0
+            output += f'e {e.source + 1} {e.target + 1} {sentiment}\n'
+        output += f'g {i+1}\n'
+        output += 'x 0\n\n'
+    output = output.strip() + '\n'
+    return output
+
+
+def write_with_reference(convert, graphs: list, filepath: str):
+    with open(filepath, 'w') as f:
+        f.write(convert(graphs))
+
+
+def write_streaming(write, graphs: list, filepath: str):
+    with open(filepath, 'w') as f:
+        write(graphs, f)
+
+
+def benchmark_fsm_writers(repeats: int = 3, bootstraps: int = 10):
+    print('Benchmarking gSpan and NEL writers')
+    print(f'{"graphs":<28}{"format":>8}{"reference (ms)":>16}{"streaming (ms)":>16}{"speedup":>9}')
+    corpus = HashtagCorpus()
+    user_graphs = [g.simplify() for g in corpus.user_graphs()]
+    sentiment_graphs = [g.simplify(multiple=False) for g in corpus.sentiment_user_graphs()]
+    # null models like the ones fsm.py mines
+    null_models = [ig.Graph.Degree_Sequence(g.degree(mode='in'), g.degree(mode='out')).simplify() for g in user_graphs for _ in range(bootstraps)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filepath = os.path.join(tmp, 'graphs')
+        for label, graphs in [('user graphs', user_graphs), ('sentiment user graphs', sentiment_graphs), (f'{len(null_models)} null models', null_models)]:
+            for extension, convert, write in [('gspan', igraph_to_gspan_reference, write_gspan), ('nel', igraph_to_nel_reference, write_nel)]:
+                t_reference, _ = timeit(write_with_reference, convert, graphs, filepath, repeats=repeats)
+                with open(filepath) as f:
+                    reference = f.read()
+                t_streaming, _ = timeit(write_streaming, write, graphs, filepath, repeats=repeats)
+                with open(filepath) as f:
+                    assert f.read() == reference
+                print(f'{label:<28}{extension:>8}{t_reference * 1000:>16.2f}{t_streaming * 1000:>16.2f}{t_reference / t_streaming:>8.1f}x')
+
+
+
+def gspan_to_igraph_reference(gspan_content: str) -> list:
+    # original implementation of utils.fsm_utils.gspan_to_igraph
+    graphs = []
+    edges = []
+    support = None
+    lines = gspan_content.strip().split('\n')
+    for line in lines:
+        if line.startswith('e'):
+            u, v, s = map(int, line.split(' ')[1:4])
+            edges.append((u, v, s))
+        elif line.startswith('t') and not line.startswith('t # 0'):
+            g = ig.Graph.TupleList(edges, directed=False, edge_attrs=['sentiment_value'])
+            if support is not None:
+                g['support'] = support
+            graphs.append(g)
+            edges = []
+            if len(line.split(' ')) > 3 and line.split(' ')[3] == '*':
+                support = int(line.split(' ')[4])
+        elif line.startswith('t # 0'):
+            parts = line.split(' ')
+            if len(parts) > 3 and parts[3] == '*':
+                support = int(parts[4])
+            else:
+                support = None
+    g = ig.Graph.TupleList(edges, directed=False, edge_attrs=['sentiment_value'])
+    g['support'] = support
+    graphs.append(g)
+    return graphs
+
+
+def nel_to_igraph_reference(nel_content: str) -> list:
+    # original implementation of utils.fsm_utils.nel_to_igraph
+    graphs = []
+    vertices = set()
+    edges = []
+    lines = nel_content.strip().split('\n')
+    for line in lines:
+        if line.startswith('v') or line.startswith('n'):
+            u = int(line.split(' ')[1]) - 1
+            vertices.add(u)
+        elif line.startswith('e') or line.startswith('d'):
+            u, v, s = int(line.split(' ')[1]) - 1, int(line.split(' ')[2]) - 1, int(line.split(' ')[3])
+            edges.append((u, v, s))
+        elif line.startswith('g'):
+            g = ig.Graph(directed=True)
+            for v in vertices:
+                g.add_vertex(v)
+            for u, v, s in edges:
+                g.add_edge(u, v, sentiment_value=s)
+            graphs.append(g)
+            vertices = set()
+            edges = []
+        elif line.startswith('s'):
+            support = int(line.split(' ')[3])
+            graphs[-1]['support'] = support
+    return graphs
+
+
+def read_with_reference(convert, filepath: str) -> list:
+    with open(filepath, 'r') as f:
+        return convert(f.read())
+
+
+def assert_same_patterns(reference: list, streaming: list):
+    assert len(reference) == len(streaming)
+    for g_reference, g_streaming in zip(reference, streaming):
+        assert g_reference.get_edgelist() == g_streaming.get_edgelist()
+        assert g_reference.vs['name'] == g_streaming.vs['name']
+        assert g_reference.es.attributes() == g_streaming.es.attributes()
+        assert all(g_reference.es[attr] == g_streaming.es[attr] for attr in g_reference.es.attributes())
+        assert g_reference['support'] == g_streaming['support']
+
+
+def benchmark_fsm_parsers(repeats: int = 3, copies: int = 200):
+    print('Benchmarking gSpan and MoSS pattern parsers')
+    print(f'{"file":<32}{"patterns":>10}{"reference (ms)":>16}{"streaming (ms)":>16}{"speedup":>9}{"filtered (ms)":>15}')
+    path = '../data/fsm/subgraphs/'
+    with tempfile.TemporaryDirectory() as tmp:
+        for file in sorted(os.listdir(path)):
+            convert, read = (gspan_to_igraph_reference, read_gspan_patterns) if file.endswith('.fp') else (nel_to_igraph_reference, read_nel_patterns)
+
+            # repeat the patterns to get the size of a low support run
+            with open(os.path.join(path, file), 'r') as f:
+                content = f.read().strip() + '\n\n'
+            filepath = os.path.join(tmp, file)
+            with open(filepath, 'w') as f:
+                if file.endswith('.fp'):
+                    # gSpan numbers its patterns, and only the first one may be 't # 0'
+                    count = content.count('\nt # ') + 1
+                    for copy in range(copies):
+                        f.write(re.sub(r'^t # (\d+)', lambda m: f't # {int(m.group(1)) + copy * count}', content, flags=re.MULTILINE))
+                else:
+                    f.write(content * copies)
+
+            t_reference, reference = timeit(read_with_reference, convert, filepath, repeats=repeats)
+            t_streaming, streaming = timeit(lambda: list(read(filepath)), repeats=repeats)
+            assert_same_patterns(reference, streaming)
+            t_filtered, _ = timeit(lambda: list(read(filepath, min_vertices=6)), repeats=repeats)
+            print(f'{file:<32}{len(streaming):>10}{t_reference * 1000:>16.2f}{t_streaming * 1000:>16.2f}{t_reference / t_streaming:>8.1f}x{t_filtered * 1000:>15.2f}')
+
+
+def motif_occurrences_reference(motifs: list, targets: dict, motif_edge_color: str = None) -> list:
+    # serial subisomorphic_vf2 calls of the original analyze_motif in fsm.py
+    return [{name: [g.subisomorphic_vf2(motif, edge_color1=edge_color, edge_color2=motif_edge_color if edge_color is not None else None) for g in graphs]
+             for name, (graphs, edge_color) in targets.items()} for motif in motifs]
+
+
+def engine_occurrences(motifs: list, targets: dict, motif_edge_color: str = None, **kwargs) -> tuple:
+    with MotifOccurrenceEngine(targets, **kwargs) as engine:
+        return engine.occurrences(motifs, motif_edge_color), engine.skip_rate()
+
+
+def benchmark_motifs(repeats: int = 1, bootstraps: int = 3, workers: int = os.cpu_count()):
+    print(f'Benchmarking motif occurrences against user graphs and {bootstraps} null models per graph, {workers} workers')
+    check_canonical_forms()
+    print(f'{"motifs":<32}{"pairs":>10}{"reference (s)":>15}{"engine (s)":>12}{"pruned (s)":>12}{"prefilter (s)":>15}{"skipped":>9}{"speedup":>9}')
+    corpus = HashtagCorpus()
+    graph_sets = {
+        'graph': [g.simplify() for g in corpus.user_graphs()],
+        'sentiment_graph': [g.simplify(multiple=False) for g in corpus.sentiment_user_graphs()]
+    }
+    for key, graphs in graph_sets.items():
+        colored = 'sentiment' in key
+        motifs = list(read_nel_patterns(f'../data/fsm/subgraphs/{key}.nel.moss'))
+        targets = {'graphs': (graphs, 'stitcher_sentiment_value' if colored else None)}
+        if not colored:
+            targets['confs'] = ([ig.Graph.Degree_Sequence(g.degree(mode='in'), g.degree(mode='out')).simplify() for g in graphs for _ in range(bootstraps)], None)
+            targets['ers'] = ([ig.Graph.Erdos_Renyi(n=g.vcount(), m=g.ecount(), directed=True).simplify(multiple=False) for g in graphs for _ in range(bootstraps)], None)
+        motif_edge_color = 'sentiment_value' if colored else None
+        pairs = len(motifs) * sum(len(target_graphs) for target_graphs, _ in targets.values())
+
+        t_reference, reference = timeit(motif_occurrences_reference, motifs, targets, motif_edge_color, repeats=repeats)
+        t_engine, (engine, _) = timeit(engine_occurrences, motifs, targets, motif_edge_color, workers=workers, prefilter=False, memoize=False, repeats=repeats)
+        t_pruned, (pruned, skip_rate) = timeit(engine_occurrences, motifs, targets, motif_edge_color, workers=workers, repeats=repeats)
+        # the invariant prefilter on top of memoization, off by default until it is faster than without
+        t_prefilter, (prefiltered, _) = timeit(engine_occurrences, motifs, targets, motif_edge_color, workers=workers, prefilter=True, repeats=repeats)
+        assert engine == reference and pruned == reference and prefiltered == reference
+        print(f'{key + ".nel.moss":<32}{pairs:>10}{t_reference:>15.2f}{t_engine:>12.2f}{t_pruned:>12.2f}{t_prefilter:>15.2f}{skip_rate:>8.1%}{t_reference / t_pruned:>8.1f}x')
+
+
+def motif_census_reference(g: ig.Graph, size: int, edge_color: str = None) -> Counter:
+    # every vertex set of size vertices whose induced subgraph is connected, keyed on the form of that subgraph
+    census = Counter()
+    for vertices in itertools.combinations(range(g.vcount()), size):
+        sub = g.induced_subgraph(vertices)
+        if not sub.is_connected(mode='weak'):
+            continue
+        # one edge per vertex pair without self loops, colored with the sorted tuple of the colors of multi-edges
+        pair_colors = {}
+        for (u, v), color in zip(sub.get_edgelist(), sub.es[edge_color] if edge_color is not None else [None] * sub.ecount()):
+            if u != v:
+                pair_colors.setdefault((u, v) if g.is_directed() else (min(u, v), max(u, v)), []).append(color)
+        motif = ig.Graph(n=size, edges=list(pair_colors), directed=g.is_directed())
+        if edge_color is not None:
+            motif.es['color'] = [colors[0] if len(colors) == 1 else tuple(sorted(colors)) for colors in pair_colors.values()]
+        census[get_canonical_form(motif, 'color' if edge_color is not None else None)] += 1
+    return census
+
+
+def count_isoclasses(size: int, directed: bool) -> int:
+    # motifs_randesu returns a count for every isoclass, connected or not
+    return len(ig.Graph(n=size, directed=directed).motifs_randesu(size=size))
+
+
+def motif_census_lad(g: ig.Graph, size: int) -> Counter:
+    # uncolored census from induced LAD matches of every connected isoclass, each occurrence found once per automorphism
+    simple = ig.Graph(n=g.vcount(), edges=g.get_edgelist(), directed=g.is_directed()).simplify()
+    census = Counter()
+    for isoclass in range(count_isoclasses(size, g.is_directed())):
+        pattern = ig.Graph.Isoclass(size, isoclass, directed=g.is_directed())
+        if not pattern.is_connected(mode='weak'):
+            continue
+        count = len(simple.get_subisomorphisms_lad(pattern, induced=True)) // pattern.count_automorphisms()
+        if count > 0:
+            census[get_canonical_form(pattern)] += count
+    return census
+
+
+def random_census_graph(n: int, m: int, directed: bool, multi: bool, seed: int) -> ig.Graph:
+    # random graph with self loops, and multi-edges if multi, with two edge colors
+    rng = random.Random(seed)
+    edges = [(rng.randrange(n), rng.randrange(n)) for _ in range(m)]
+    if multi:
+        edges += rng.sample(edges, m // 5)
+    g = ig.Graph(n=n, edges=edges, directed=directed)
+    if not multi:
+        g.simplify(loops=False)
+    g.es['color'] = [rng.randrange(2) for _ in g.es]
+    return g
+
+
+def check_canonical_forms(seed: int = 0, samples: int = 200):
+    # forms of isomorphic motifs are equal, and forms of non-isomorphic ones differ, also with colored edges.
+    # Both the memo keys of MotifOccurrenceEngine and the census rows rely on this
+    rng = random.Random(seed)
+    for directed, size in [(True, 3), (True, 4), (False, 4)]:
+        forms = {get_canonical_form(ig.Graph.Isoclass(size, isoclass, directed=directed)) for isoclass in range(count_isoclasses(size, directed))}
+        assert len(forms) == count_isoclasses(size, directed)
+    for _ in range(samples):
+        motif = random_census_graph(4, 6, rng.random() < 0.5, False, rng.randrange(2 ** 32))
+        permutation = rng.sample(range(4), 4)
+        assert get_canonical_form(motif.permute_vertices(permutation), 'color') == get_canonical_form(motif, 'color')
+
+
+def benchmark_motif_census(repeats: int = 1, seed: int = 0):
+    print('Benchmarking motif census against brute force over all vertex sets and induced LAD matches')
+    check_canonical_forms(seed)
+
+    print(f'{"graph":<46}{"forms":>7}{"reference (s)":>15}{"lad (s)":>9}{"census (s)":>12}{"speedup":>9}')
+    for directed, multi, colored in itertools.product([True, False], [False, True], [False, True]):
+        g = random_census_graph(30, 60, directed, multi, seed)
+        edge_color = 'color' if colored else None
+        for size in [3, 4]:
+            t_reference, reference = timeit(motif_census_reference, g, size, edge_color, repeats=repeats)
+            t_census, census = timeit(motif_census, g, size, edge_color, repeats=repeats)
+            assert census == reference
+            t_lad = None
+            if not colored:
+                t_lad, lad = timeit(motif_census_lad, g, size, repeats=repeats)
+                assert lad == reference
+            name = f'{"directed" if directed else "undirected"}{", multi-edges" if multi else ""}{", colored" if colored else ""}, {size} vertices'
+            print(f'{name:<46}{len(census):>7}{t_reference:>15.2f}{t_lad if t_lad is not None else float("nan"):>9.2f}{t_census:>12.4f}{t_reference / t_census:>8.1f}x')
+
+
+benchmarks = {
+    'load_edges': benchmark_load_edges,
+    'edge_cache': benchmark_edge_cache,
+    'parallel_load': benchmark_parallel_load,
+    'sentiment': benchmark_sentiment,
+    'load_sentiment': benchmark_load_sentiment,
+    'project': benchmark_project,
+    'fsm_writers': benchmark_fsm_writers,
+    'fsm_parsers': benchmark_fsm_parsers,
+    'motifs': benchmark_motifs,
+    'motif_census': benchmark_motif_census,
+}
+
+if __name__ == '__main__':
+    args_lower = [arg.lower() for arg in sys.argv[1:]]
+    if len(args_lower) == 0 or 'help' in args_lower:
+        print('Usage: python misc/benchmarks.py BENCHMARK [BENCHMARK ...]')
+        print(f'Available benchmarks: {", ".join(benchmarks)}, all')
+        sys.exit(0)
+
+    selected = list(benchmarks) if 'all' in args_lower else [arg for arg in args_lower if arg in benchmarks]
+    if len(selected) == 0:
+        raise ValueError(f'No valid benchmark provided. Available benchmarks are: {", ".join(benchmarks)}')
+
+    for name in selected:
+        benchmarks[name]()
+        print()
@@ -5,51 +5,65 @@ import matplotlib.pyplot as plt
 import re
 import json
 import numpy as np
-from utils.graph_utils import load_edges, get_video_graph, get_user_graph, degree_centralization, closeness_centralization, betweenness_centralization, project_graph
+from utils.graph_utils import load_edges_cached, get_video_graph, get_user_graph, degree_centralization, closeness_centralization_with_error, betweenness_centralization_with_error, component_centralizations, project_graph, centralization_seed
+from utils.metrics_utils import MetricsCache, get_graph_fingerprint, centralization_params
 
 
-def output_summary_statistics(G: ig.Graph) -> dict:
+def output_summary_statistics(G: ig.Graph, sample_size: int = None, seed: int = centralization_seed, cache: MetricsCache = None) -> dict:
+    # closeness and betweenness of large components are sampled estimates, see utils.graph_utils.estimate_centralization
+    # with a cache, the statistics of a graph with the same edges are read back instead of computed
+    if cache is not None:
+        fingerprint = get_graph_fingerprint(G)
+        params = {'centralization': centralization_params, 'sample_size': sample_size, 'seed': seed}
+        metrics = cache.get(fingerprint, 'summary_statistics', params)
+        if metrics is not None:
+            return dict(metrics)
+
     G_un = G.as_undirected()
     G_simple = G_un.simplify()
 
+    # simplifying keeps the vertices, so one decomposition serves both graphs
+    components = G_un.components()
+    sizes = components.sizes()
+
     metrics = {}
     metrics['Vertices'] = G.vcount()
     metrics['Edges'] = G.ecount()
-    metrics['Components'] = len(G_un.components())
-    metrics['Largest component size'] = max(G_un.components().sizes())
+    metrics['Components'] = len(sizes)
+    metrics['Largest component size'] = max(sizes)
     metrics['Degree Assortativity'] = G.assortativity_degree(directed=True)
     metrics['Clustering Coefficient'] = G.transitivity_undirected()
     metrics['Diameter'] = G.diameter()
     metrics['Undirected Diameter'] = G_un.diameter()
     metrics['Reciprocity'] = G.reciprocity()
-    metrics['% of vertices in the largest component'] = max(G_un.components().sizes()) / G.vcount()
-
-    components = G_simple.components()
-    c_sizes = [len(c) for c in components if len(c) > 2]
-    if len(c_sizes) > 0:
-
-        degree_centralizations = [degree_centralization(G_simple.subgraph(c)) for c in components if len(c) > 2]
-        closeness_centralizations = [closeness_centralization(G_simple.subgraph(c)) for c in components if len(c) > 2]
-        betweenness_centralizations = [betweenness_centralization(G_simple.subgraph(c)) for c in components if len(c) > 2]
-
-        lcc_degree_centralization = degree_centralizations[np.argmax(c_sizes)]
-        lcc_closeness_centralization = closeness_centralizations[np.argmax(c_sizes)]
-        lcc_betweenness_centralization = betweenness_centralizations[np.argmax(c_sizes)]
-
-        metrics['Global degree centralization'] = degree_centralization(G_simple.as_undirected())
-        metrics['Largest component degree centralization'] = lcc_degree_centralization
-        #metrics['Avg. local degree centralization'] = np.mean(degree_centralizations)
-        #metrics['Weighted avg. local degree centralization'] = np.average(degree_centralizations, weights=c_sizes)
-
-        metrics['Global closeness centralization'] = closeness_centralization(G_simple.as_undirected())
-        metrics['Largest component closeness centralization'] = lcc_closeness_centralization
-        #metrics['Avg. local closeness centralization'] = np.mean(closeness_centralizations)
-        #metrics['Weighted avg. local closeness centralization'] = np.average(closeness_centralizations, weights=c_sizes)
-
-        metrics['Global betweenness centralization'] = betweenness_centralization(G_simple.as_undirected())
-        metrics['Largest component betweenness centralization'] = lcc_betweenness_centralization
-        #metrics['Avg. local betweenness centralization'] = np.mean(betweenness_centralizations)
-        #metrics['Weighted avg. local betweenness centralization'] = np.average(betweenness_centralizations, weights=c_sizes)
+    metrics['% of vertices in the largest component'] = max(sizes) / G.vcount()
+
+    # only the largest component is reported, set lcc_only=False to get every component for local averages
+    centralizations = component_centralizations(G_simple, components, lcc_only=True, sample_size=sample_size, seed=seed)
+    if len(centralizations) > 0:
+        lcc = centralizations[0]
+
+        metrics['Global degree centralization'] = degree_centralization(G_simple)
+        metrics['Largest component degree centralization'] = lcc['degree'][0]
+        #metrics['Avg. local degree centralization'] = np.mean([c['degree'][0] for c in centralizations])
+        #metrics['Weighted avg. local degree centralization'] = np.average([c['degree'][0] for c in centralizations], weights=[c['size'] for c in centralizations])
+
+        metrics['Global closeness centralization'], metrics['Global closeness centralization error'] = \
+            closeness_centralization_with_error(G_simple, sample_size, seed)
+        metrics['Largest component closeness centralization'], metrics['Largest component closeness centralization error'] = \
+            lcc['closeness']
+        #metrics['Avg. local closeness centralization'] = np.mean([c['closeness'][0] for c in centralizations])
+        #metrics['Weighted avg. local closeness centralization'] = np.average([c['closeness'][0] for c in centralizations], weights=[c['size'] for c in centralizations])
+
+        metrics['Global betweenness centralization'], metrics['Global betweenness centralization error'] = \
+            betweenness_centralization_with_error(G_simple, sample_size, seed)
+        metrics['Largest component betweenness centralization'], metrics['Largest component betweenness centralization error'] = \
+            lcc['betweenness']
+        #metrics['Avg. local betweenness centralization'] = np.mean([c['betweenness'][0] for c in centralizations])
+        #metrics['Weighted avg. local betweenness centralization'] = np.average([c['betweenness'][0] for c in centralizations], weights=[c['size'] for c in centralizations])
+
+    if cache is not None:
+        cache.set(fingerprint, 'summary_statistics', metrics, params)
 
     return metrics
 
@@ -147,6 +161,9 @@ if __name__ == '__main__':
         special_args = ['true', 'false', 'all', 'project']
         hashtag_args = [arg for arg in argv[1:] if arg.lower() not in special_args]
 
+    # summary statistics of unchanged graphs are read from ../data/cache/metrics/, new ones are saved after the last hashtag
+    metrics_cache = MetricsCache()
+
     all_video_metrics_df = pd.DataFrame()
     all_user_metrics_df = pd.DataFrame()
     all_video_proj_metrics_df = pd.DataFrame()
@@ -165,7 +182,7 @@ if __name__ == '__main__':
 
 
         # read edges from file
-        edges = load_edges(f'../data/hashtags/edges/{hashtag}_edges.txt')
+        edges = load_edges_cached(f'../data/hashtags/edges/{hashtag}_edges.txt')
 
         # construct graph
         G = get_video_graph(edges)
@@ -174,7 +191,7 @@ if __name__ == '__main__':
         G.vs['username'] = [vertices[str(v)]['username'] if str(v) in vertices else None for v in G.vs['name'] if str(v) in vertices]
         G.vs['create_time'] = [vertices[str(v)]['create_time'] if str(v) in vertices else None for v in G.vs['name'] if str(v) in vertices]
         # Get metrics
-        video_metrics = output_summary_statistics(G)
+        video_metrics = output_summary_statistics(G, cache=metrics_cache)
 
         # Convert the metrics dictionary to a DataFrame
         video_metrics_df = pd.DataFrame(video_metrics, index=[hashtag])
@@ -196,7 +213,7 @@ if __name__ == '__main__':
         if do_project:
             print(f'Projecting graph for {hashtag}')
             G_proj = project_graph(G)
-            G_proj_metrics = output_summary_statistics(G_proj)
+            G_proj_metrics = output_summary_statistics(G_proj, cache=metrics_cache)
             video_proj_metrics_df = pd.DataFrame(G_proj_metrics, index=[hashtag])
             all_video_proj_metrics_df = pd.concat([all_video_proj_metrics_df.copy(), video_proj_metrics_df], axis=0)
 
@@ -211,7 +228,7 @@ if __name__ == '__main__':
         # Repeat for user graph
         G = get_user_graph(edges)
         print(f'\nUser Graph for {hashtag}')
-        user_metrics = output_summary_statistics(G)
+        user_metrics = output_summary_statistics(G, cache=metrics_cache)
 
         # Convert user graph metrics to a DataFrame
         user_metrics_df = pd.DataFrame(user_metrics, index=[f'{hashtag}'])
@@ -237,7 +254,7 @@ if __name__ == '__main__':
         if do_project:
             print(f'Projecting user graph for {hashtag}')
             G_proj = project_graph(G)
-            G_proj_metrics = output_summary_statistics(G_proj)
+            G_proj_metrics = output_summary_statistics(G_proj, cache=metrics_cache)
             user_proj_metrics_df = pd.DataFrame(G_proj_metrics, index=[hashtag])
             all_user_proj_metrics_df = pd.concat([all_user_proj_metrics_df.copy(), user_proj_metrics_df], axis=0)
 
@@ -263,6 +280,8 @@ if __name__ == '__main__':
         all_video_metrics_df = pd.concat([all_video_metrics_df.copy(), video_metrics_df], axis=0)
         all_user_metrics_df = pd.concat([all_user_metrics_df.copy(), user_metrics_df], axis=0)
 
+    metrics_cache.save()
+
 
     #Convert cols to ints
     all_video_metrics_df[['Vertices', 'Edges', 'Components', 'Largest component size']] = all_video_metrics_df[['Vertices', 'Edges', 'Components', 'Largest component size']].astype(int)
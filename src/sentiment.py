@@ -1,6 +1,7 @@
 if __name__ == '__main__':
-    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    from utils.sentiment_utils import score_texts, compound_to_label
     from sys import argv
+    import os
     import json
     from pathlib import Path
 
@@ -14,25 +15,11 @@ if __name__ == '__main__':
         for line in f:
             data.append(json.loads(line))
     
-    # Initialize sentiment analyzer
-    analyzer = SentimentIntensityAnalyzer()
-
-    # Analyze sentiment of each transcription
-    transcriptions = [d['transcription'] for d in data]
-    sentiments = [analyzer.polarity_scores(transcription) if transcription else None for transcription in transcriptions]
+    # Analyze sentiment of each transcription, in parallel and skipping transcriptions scored in earlier runs
+    transcriptions = [d['transcription'] if d['transcription'] else None for d in data]
+    sentiments = score_texts(transcriptions, workers=os.cpu_count())
     # Convert to categorical
-    categorical_sentiments = []
-    for sentiment in sentiments:
-        if sentiment is None:
-            categorical_sentiments.append(None)
-            continue
-        compound = sentiment['compound']
-        if compound > 0.05:
-            categorical_sentiments.append('positive')
-        elif compound < -0.05:
-            categorical_sentiments.append('negative')
-        else:
-            categorical_sentiments.append('neutral')
+    categorical_sentiments = [compound_to_label(sentiment['compound']) if sentiment is not None else None for sentiment in sentiments]
     
     # Write to existing transcription data file
     for i, d in enumerate(data):
@@ -0,0 +1,262 @@
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import igraph as ig
+import numpy as np
+
+from utils.file_utils import atomic_write
+from utils.motif_utils import graph_to_match_arrays, graph_from_match_arrays, get_canonical_form, get_null_model_spec, get_null_model_tasks, iter_task_null_models, \
+    null_model_seed, null_model_batch_size
+
+# number of vertices of the motifs counted by default, like the -n4 limit of the MoSS runs
+census_motif_size = 4
+
+# specs of the graphs whose null models the current worker process counts, see init_census_worker
+worker_census_specs = None
+
+
+def get_isoclass_form(size: int, isoclass: int, directed: bool) -> tuple:
+    return get_canonical_form(ig.Graph.Isoclass(size, isoclass, directed=directed))
+
+
+def get_pair_colors(g: ig.Graph, edge_color: str) -> dict:
+    # colors of the edges between each pair of vertices, a single color or a sorted tuple of the colors of multi-edges
+    pair_colors = {}
+    for (u, v), color in zip(g.get_edgelist(), g.es[edge_color]):
+        pair = (u, v) if g.is_directed() else (min(u, v), max(u, v))
+        pair_colors.setdefault(pair, []).append(color)
+    return {pair: colors[0] if len(colors) == 1 else tuple(sorted(colors)) for pair, colors in pair_colors.items()}
+
+
+def get_signature_form(size: int, signature: tuple, directed: bool) -> tuple:
+    # canonical form of the colored motif whose colors per vertex pair are signature, see motif_census
+    pairs = [(i, j) for i in range(size) for j in range(size) if i != j and (directed or i < j)]
+    edges = [(pair, color) for pair, color in zip(pairs, signature) if color is not None]
+    motif = ig.Graph(n=size, edges=[pair for pair, _ in edges], directed=directed)
+    motif.es['color'] = [color for _, color in edges]
+    return get_canonical_form(motif, 'color')
+
+
+def motif_census(g: ig.Graph, size: int = census_motif_size, edge_color: str = None) -> Counter:
+    """
+    Counts the connected induced subgraphs of g with size vertices, keyed on their canonical form (see get_canonical_form).
+    Multi-edges and self loops are ignored for the structure. Without edge_color the counts come straight from motifs_randesu.
+    With edge_color every occurrence is also told apart by the colors of its edges, where multi-edges count as one edge
+    colored with the tuple of their colors.
+    """
+    directed = g.is_directed()
+    simple = ig.Graph(n=g.vcount(), edges=g.get_edgelist(), directed=directed).simplify()
+    if edge_color is None:
+        counts = simple.motifs_randesu(size=size)
+        # unconnected isoclasses come back as nan
+        return Counter({get_isoclass_form(size, isoclass, directed): int(count) for isoclass, count in enumerate(counts) if count == count and count > 0})
+
+    pair_colors = get_pair_colors(g, edge_color)
+    signatures = Counter()
+
+    def count_occurrence(graph, vertices, isoclass):
+        # the colors of every ordered vertex pair identify the colored subgraph up to the order of vertices
+        signatures[tuple(pair_colors.get((u, v) if directed or u < v else (v, u)) for i, u in enumerate(vertices) for j, v in enumerate(vertices)
+                         if i != j and (directed or i < j))] += 1
+
+    simple.motifs_randesu(size=size, callback=count_occurrence)
+    census = Counter()
+    for signature, count in signatures.items():
+        census[get_signature_form(size, signature, directed)] += count
+    return census
+
+
+def get_isoclass_census(g: ig.Graph, size: int = census_motif_size) -> np.ndarray:
+    # counts per isoclass of the uncolored connected induced subgraphs with size vertices, 0 for unconnected isoclasses
+    simple = ig.Graph(n=g.vcount(), edges=g.get_edgelist(), directed=g.is_directed()).simplify()
+    return np.nan_to_num(np.array(simple.motifs_randesu(size=size), dtype=np.float64)).astype(np.int64)
+
+
+def get_connected_isoclasses(size: int, directed: bool) -> list:
+    # isoclasses that motifs_randesu counts, the others are never connected
+    counts = ig.Graph.Full(size, directed=directed).motifs_randesu(size=size)
+    return [isoclass for isoclass, count in enumerate(counts) if count == count]
+
+
+def motif_census_from_arrays(task: tuple) -> Counter:
+    # runs in a worker process, see get_census_matrices
+    arrays, size = task
+    return motif_census(graph_from_match_arrays(arrays), size, 'color' if arrays['edge_colors'] is not None else None)
+
+
+def census_to_matrix(censuses: list, forms: list) -> np.ndarray:
+    return np.array([[census.get(form, 0) for form in forms] for census in censuses], dtype=np.int64).reshape(len(censuses), len(forms))
+
+
+def get_census_forms(censuses: list) -> list:
+    # every form found in censuses, in a fixed order
+    return sorted(set(form for census in censuses for form in census), key=repr)
+
+
+def get_census_matrices(targets: dict, size: int = census_motif_size, workers: int = None) -> tuple:
+    """
+    Returns the motif census of every target graph as one matrix per target set, with a row per graph and
+    a column per motif form, and the list of forms. targets maps a target set name to a list of graphs and
+    the edge attribute holding their colors, or None. Graphs are counted in a process pool when workers > 1.
+    """
+    tasks = [(graph_to_match_arrays(g, edge_color), size) for graphs, edge_color in targets.values() for g in graphs]
+    if workers is None or workers <= 1:
+        censuses = [motif_census_from_arrays(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            censuses = list(executor.map(motif_census_from_arrays, tasks))
+
+    forms = get_census_forms(censuses)
+    matrices = {}
+    start = 0
+    for name, (graphs, _) in targets.items():
+        matrices[name] = census_to_matrix(censuses[start:start + len(graphs)], forms)
+        start += len(graphs)
+    return matrices, forms
+
+
+def init_census_worker(specs: list) -> None:
+    global worker_census_specs
+    worker_census_specs = specs
+
+
+def null_model_census_task(task: tuple) -> list:
+    # runs in a worker process, or in the main process when counting serially
+    model, items, bootstraps, batch_size, undirected, size = task
+    return [motif_census(g, size) for null_models in iter_task_null_models(model, items, worker_census_specs, bootstraps, batch_size, undirected) for g in null_models]
+
+
+def get_null_model_census(graphs: list, model: str, bootstraps: int, size: int = census_motif_size, seed: int = null_model_seed, batch_size: int = null_model_batch_size,
+                          workers: int = None, undirected: bool = False) -> tuple:
+    """
+    Returns the uncolored motif census of the bootstraps null models of every graph, see motif_census, as an array of
+    shape (graphs, bootstraps, forms), and the list of forms. The null models are the ones of count_null_model_occurrences
+    for the same seed, generated and counted one batch at a time in the workers.
+    """
+    tasks = [(model, items, bootstraps, batch_size, undirected, size) for items in get_null_model_tasks(graphs, model, bootstraps, seed, batch_size)]
+    specs = [get_null_model_spec(g, model) for g in graphs]
+    if workers is None or workers <= 1:
+        init_census_worker(specs)
+        censuses = [census for task in tasks for census in null_model_census_task(task)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_census_worker, initargs=(specs,)) as executor:
+            censuses = [census for task_censuses in executor.map(null_model_census_task, tasks) for census in task_censuses]
+
+    forms = get_census_forms(censuses)
+    return census_to_matrix(censuses, forms).reshape(len(graphs), bootstraps, len(forms)), forms
+
+
+def census_significance_task(task: tuple) -> tuple:
+    # runs in a worker process, or in the main process when sampling serially
+    i, model, items, samples, batch_size, size, undirected, observed = task
+    sums = np.zeros(len(observed), dtype=np.float64)
+    squares = np.zeros(len(observed), dtype=np.float64)
+    at_least = np.zeros(len(observed), dtype=np.int64)
+    at_most = np.zeros(len(observed), dtype=np.int64)
+    # only one batch of null models and their running totals are held at a time
+    for null_models in iter_task_null_models(model, items, worker_census_specs, samples, batch_size, undirected):
+        for g in null_models:
+            counts = get_isoclass_census(g, size)
+            sums += counts
+            squares += counts.astype(np.float64) ** 2
+            at_least += counts >= observed
+            at_most += counts <= observed
+    return i, sums, squares, at_least, at_most
+
+
+def get_significance_record(g: ig.Graph, i: int, model: str, samples: int, seed: int, size: int, directed: bool, observed: np.ndarray, stats: tuple) -> dict:
+    sums, squares, at_least, at_most = stats
+    mean = sums / samples
+    std = np.sqrt(np.maximum(squares - samples * mean ** 2, 0) / (samples - 1)) if samples > 1 else np.zeros(len(mean))
+    motifs = []
+    for isoclass in get_connected_isoclasses(size, directed):
+        motifs.append({
+            'isoclass': isoclass,
+            'edges': ig.Graph.Isoclass(size, isoclass, directed=directed).get_edgelist(),
+            'count': int(observed[isoclass]),
+            'null_mean': float(mean[isoclass]),
+            'null_std': float(std[isoclass]),
+            'z_score': float((observed[isoclass] - mean[isoclass]) / std[isoclass]) if std[isoclass] > 0 else None,
+            # empirical p-values of over- and under-representation, never 0 for a finite ensemble
+            'p_value': float((1 + at_least[isoclass]) / (1 + samples)),
+            'p_value_under': float((1 + at_most[isoclass]) / (1 + samples))
+        })
+    return {
+        'graph_index': i,
+        'graph_label': g['name'] if 'name' in g.attributes() else None,
+        'model': model,
+        'samples': samples,
+        'seed': seed,
+        'size': size,
+        'motifs': motifs
+    }
+
+
+def iter_census_significance(graphs: list, model: str, samples: int, size: int = census_motif_size, seed: int = null_model_seed, workers: int = None,
+                             undirected: bool = False, batch_size: int = null_model_batch_size):
+    """
+    Yields for every graph, in order, the z-scores and empirical p-values of its uncolored motif counts against samples
+    null models of the graph, see get_significance_record. Each graph is a task whose null models are seeded from
+    seed and the graph index only, so results do not depend on workers, and generated batch_size at a time.
+    Records are yielded as they complete in graph order, so callers can write them incrementally.
+    """
+    # one task per graph, seeded the same way as count_null_model_occurrences: grouping the seeds by samples puts
+    # every graph's seeds in a task of its own, which the task then generates in batches of batch_size
+    tasks = []
+    for items in get_null_model_tasks(graphs, model, samples, seed, batch_size=samples):
+        i = items[0][0]
+        observed = get_isoclass_census(graphs[i].as_undirected(mode='each') if undirected else graphs[i], size)
+        tasks.append((i, model, items, samples, batch_size, size, undirected, observed))
+    # null models are generated from the original graphs and made undirected afterwards, like the observed graphs
+    specs = [get_null_model_spec(g, model) for g in graphs]
+
+    executor = None
+    if workers is not None and workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_census_worker, initargs=(specs,))
+        results = executor.map(census_significance_task, tasks)
+    else:
+        init_census_worker(specs)
+        results = map(census_significance_task, tasks)
+    try:
+        for (i, *stats), task in zip(results, tasks):
+            yield get_significance_record(graphs[i], i, model, samples, seed, size, not undirected and graphs[i].is_directed(), task[-1], stats)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def align_census(matrix: np.ndarray, forms: list, target_forms: list) -> np.ndarray:
+    """
+    Returns matrix with its last axis reordered to target_forms, with zero counts for forms it does not have.
+    """
+    index = {form: i for i, form in enumerate(forms)}
+    aligned = np.zeros(matrix.shape[:-1] + (len(target_forms),), dtype=matrix.dtype)
+    for j, form in enumerate(target_forms):
+        if form in index:
+            aligned[..., j] = matrix[..., index[form]]
+    return aligned
+
+
+def form_to_json(form: tuple) -> str:
+    return json.dumps(form)
+
+
+def form_from_json(form: str) -> tuple:
+    directed, n, edges, colors = json.loads(form)
+    return (directed, n, tuple(tuple(edge) for edge in edges), tuple(tuple(color) if isinstance(color, list) else color for color in colors))
+
+
+def save_census(filepath: str, matrices: dict, forms: list) -> None:
+    """
+    Saves census matrices with the same forms as one npz file.
+    """
+    with atomic_write(filepath) as temporary, open(temporary, 'wb') as f:
+        np.savez_compressed(f, forms=np.array([form_to_json(form) for form in forms]), **matrices)
+
+
+def load_census(filepath: str) -> tuple:
+    with np.load(filepath) as data:
+        forms = [form_from_json(form) for form in data['forms']]
+        return {name: data[name] for name in data.files if name != 'forms'}, forms
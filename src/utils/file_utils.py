@@ -0,0 +1,20 @@
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(filepath: str):
+    """
+    Yields a temporary path next to filepath to write to, which replaces filepath once the block completes.
+    An interrupted write never leaves a partial file at filepath, and its temporary file is removed.
+    """
+    directory = os.path.dirname(filepath)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = filepath + '.tmp'
+    try:
+        yield temporary
+        os.replace(temporary, filepath)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
@@ -1,106 +1,481 @@
 import igraph as ig
+import numpy as np
+import filecmp
+import hashlib
+import io
+import json
 import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-def igraph_to_gspan(graphs: list) -> str:
+from utils.file_utils import atomic_write
+
+def get_edge_labels(g: ig.Graph, is_sentiment_graph: bool) -> list:
+    # edge labels of the mining formats, the stitcher sentiment or 0
+    if is_sentiment_graph:
+        return g.es['stitcher_sentiment_value']
+    return [0] * g.ecount()
+
+
+def format_edge_block(edges: np.ndarray, labels: list) -> str:
+    # one 'e source target label' line per edge, formatted in a single operation
+    values = [value for edge in zip(edges[:, 0].tolist(), edges[:, 1].tolist(), labels) for value in edge]
+    return 'e %d %d %s\n' * len(labels) % tuple(values)
+
+
+def write_gspan(graphs: list, f) -> None:
     """
+    Streams graphs to the file handle f in gSpan format, one write per graph:
     t # 0
     v 1 a
     v 2 b
     e 1 2 a
     """
-    output = ''
     is_sentiment_graph = 'stitcher_sentiment' in graphs[0].es.attributes()
     for i, g in enumerate(graphs):
+        # gspan only works with undirected graphs, which list every edge with the smaller vertex first
+        edges = np.array(g.get_edgelist(), dtype=np.int64).reshape(-1, 2)
         if g.is_directed():
-            g = g.as_undirected(mode='each')  # gspan only works with undirected graphs
-        output += f't # {i}\n'
-        for v in g.vs:
-            output += f'v {v.index} 0\n'
-        for e in g.es:
-            if is_sentiment_graph:
-                sentiment = e['stitcher_sentiment_value']
-            else:
-                sentiment = 0
-            output += f'e {e.source} {e.target} {sentiment}\n'
-    return output
+            edges.sort(axis=1)
+        labels = get_edge_labels(g, is_sentiment_graph)
 
-def igraph_to_nel(graphs: list) -> str:
+        vertex_block = 'v %d 0\n' * g.vcount() % tuple(range(g.vcount()))
+        edge_block = format_edge_block(edges, labels)
+        f.write(f't # {i}\n{vertex_block}{edge_block}')
+
+
+def write_nel(graphs: list, f) -> None:
     """
+    Streams graphs to the file handle f in NEL format, one write per graph:
     v 1
     v 2
     e 1 2
     g 1
     x 0
     """
-    output = ''
     is_sentiment_graph = 'stitcher_sentiment' in graphs[0].es.attributes()
     for i, g in enumerate(graphs):
-        for v in g.vs:
-            output += f'v {v.index + 1}\n'
-        for e in g.es:
-            if is_sentiment_graph:
-                sentiment = e['stitcher_sentiment_value']
-            else:
-                sentiment = 0
-            output += f'e {e.source + 1} {e.target + 1} {sentiment}\n'
-        output += f'g {i+1}\n'
-        output += 'x 0\n\n'
-    output = output.strip() + '\n'
-    return output
+        # vertices are numbered from 1
+        edges = np.array(g.get_edgelist(), dtype=np.int64).reshape(-1, 2) + 1
+        labels = get_edge_labels(g, is_sentiment_graph)
+
+        vertex_block = 'v %d\n' * g.vcount() % tuple(range(1, g.vcount() + 1))
+        edge_block = format_edge_block(edges, labels)
+        separator = '\n' if i > 0 else ''
+        f.write(f'{separator}{vertex_block}{edge_block}g {i + 1}\nx 0\n')
+
+
+def write_if_changed(filepath: str, write, graphs: list) -> bool:
+    """
+    Writes graphs to filepath with write, e.g. write_gspan or write_nel, through a temporary file that only replaces
+    filepath when its content differs. The modification time of filepath then tells when the graphs last changed,
+    see is_job_up_to_date. Returns whether filepath was replaced.
+    """
+    with open(filepath + '.tmp', 'w') as f:
+        write(graphs, f)
+    if os.path.exists(filepath) and filecmp.cmp(filepath + '.tmp', filepath, shallow=False):
+        os.remove(filepath + '.tmp')
+        return False
+    os.replace(filepath + '.tmp', filepath)
+    return True
+
+
+def igraph_to_gspan(graphs: list) -> str:
+    output = io.StringIO()
+    write_gspan(graphs, output)
+    return output.getvalue()
+
+
+def igraph_to_nel(graphs: list) -> str:
+    output = io.StringIO()
+    write_nel(graphs, output)
+    return output.getvalue()
+
+def keep_pattern(support: int, num_vertices: int, min_support: int = None, min_vertices: int = None, max_vertices: int = None) -> bool:
+    if min_support is not None and (support is None or support < min_support):
+        return False
+    if min_vertices is not None and num_vertices < min_vertices:
+        return False
+    if max_vertices is not None and num_vertices > max_vertices:
+        return False
+    return True
+
+
+def iter_gspan_patterns(lines, min_support: int = None, min_vertices: int = None, max_vertices: int = None):
+    """
+    Yields the patterns of gSpan .fp output, read from any iterable of lines such as an open file.
+    Patterns are built from their edges, so a vertex without edges is not part of the pattern.
+    Patterns with a support below min_support, or fewer than min_vertices or more than max_vertices vertices,
+    are skipped before their graph is built.
+    """
+    def build(edges: list, support: int):
+        # vertex names in order of first appearance, like ig.Graph.TupleList
+        names = list(dict.fromkeys(x for u, v, _ in edges for x in (u, v)))
+        if not keep_pattern(support, len(names), min_support, min_vertices, max_vertices):
+            return None
+        index = {name: i for i, name in enumerate(names)}
+        return ig.Graph(
+            n=len(names),
+            edges=[(index[u], index[v]) for u, v, _ in edges],
+            directed=False,
+            graph_attrs={'support': support},
+            vertex_attrs={'name': names},
+            edge_attrs={'sentiment_value': [s for _, _, s in edges]}
+        )
 
-def gspan_to_igraph(gspan_content: str) -> list:
-    graphs = []
     edges = []
     support = None
-    lines = gspan_content.strip().split('\n')
+    started = False
     for line in lines:
-        if line.startswith('e'):
-            u, v, s = map(int, line.split(' ')[1:4])
-            edges.append((u, v, s))
-        elif line.startswith('t') and not line.startswith('t # 0'):
-            g = ig.Graph.TupleList(edges, directed=False, edge_attrs=['sentiment_value'])
-            if support is not None:
-                g['support'] = support
-            graphs.append(g)
+        kind = line[:1]
+        if kind == 'e':
+            _, u, v, s = line.split(' ', 4)[:4]
+            edges.append((int(u), int(v), int(s)))
+        elif kind == 't':
+            if started:
+                g = build(edges, support)
+                if g is not None:
+                    yield g
+            started = True
             edges = []
-            if len(line.split(' ')) > 3 and line.split(' ')[3] == '*':
-                support = int(line.split(' ')[4])
-        elif line.startswith('t # 0'):
             parts = line.split(' ')
             if len(parts) > 3 and parts[3] == '*':
                 support = int(parts[4])
-            else:
+            elif line.startswith('t # 0'):
                 support = None
-    g = ig.Graph.TupleList(edges, directed=False, edge_attrs=['sentiment_value'])
-    g['support'] = support
-    graphs.append(g)
-    return graphs
+    if started:
+        g = build(edges, support)
+        if g is not None:
+            yield g
+
+
+def iter_nel_patterns(lines, min_support: int = None, min_vertices: int = None, max_vertices: int = None):
+    """
+    Yields the patterns of MoSS .moss output in NEL format, read from any iterable of lines such as an open file.
+    Patterns with a support below min_support, or fewer than min_vertices or more than max_vertices vertices,
+    are skipped before their graph is built.
+    """
+    def build(vertices: set, edges: list, support: int):
+        if not keep_pattern(support, len(vertices), min_support, min_vertices, max_vertices):
+            return None
+        # vertices are numbered from 0 in the pattern, so edges can refer to them by index
+        g = ig.Graph(n=len(vertices), edges=[(u, v) for u, v, _ in edges], directed=True, vertex_attrs={'name': list(vertices)})
+        if len(edges) > 0:
+            g.es['sentiment_value'] = [s for _, _, s in edges]
+        if support is not None:
+            g['support'] = support
+        return g
 
-def nel_to_igraph(nel_content: str) -> list:
-    graphs = []
     vertices = set()
     edges = []
-    lines = nel_content.strip().split('\n')
+    # a pattern ends at its 'g' line, but its support follows on the 's' line
+    pending = None
     for line in lines:
-        if line.startswith('v') or line.startswith('n'):
-            u = int(line.split(' ')[1]) - 1
-            vertices.add(u)
-        elif line.startswith('e') or line.startswith('d'):
-            u, v, s = int(line.split(' ')[1]) - 1, int(line.split(' ')[2]) - 1, int(line.split(' ')[3])
-            edges.append((u, v, s))
+        if line.startswith('v') or line.startswith('n') or line.startswith('e') or line.startswith('d'):
+            if pending is not None:
+                g = build(*pending, None)
+                if g is not None:
+                    yield g
+                pending = None
+            if line.startswith('v') or line.startswith('n'):
+                vertices.add(int(line.split(' ')[1]) - 1)
+            else:
+                parts = line.split(' ')
+                edges.append((int(parts[1]) - 1, int(parts[2]) - 1, int(parts[3])))
         elif line.startswith('g'):
-            g = ig.Graph(directed=True)
-            for v in vertices:
-                g.add_vertex(v)
-            for u, v, s in edges:
-                g.add_edge(u, v, sentiment_value=s)
-            graphs.append(g)
+            if pending is not None:
+                g = build(*pending, None)
+                if g is not None:
+                    yield g
+            pending = (vertices, edges)
             vertices = set()
             edges = []
-        elif line.startswith('s'):
-            support = int(line.split(' ')[3])
-            graphs[-1]['support'] = support
-    return graphs
+        elif line.startswith('s') and pending is not None:
+            g = build(*pending, int(line.split(' ')[3]))
+            if g is not None:
+                yield g
+            pending = None
+    if pending is not None:
+        g = build(*pending, None)
+        if g is not None:
+            yield g
+
+
+def read_gspan_patterns(filepath: str, min_support: int = None, min_vertices: int = None, max_vertices: int = None):
+    with open(filepath, 'r') as f:
+        yield from iter_gspan_patterns(f, min_support, min_vertices, max_vertices)
+
+
+def read_nel_patterns(filepath: str, min_support: int = None, min_vertices: int = None, max_vertices: int = None):
+    with open(filepath, 'r') as f:
+        yield from iter_nel_patterns(f, min_support, min_vertices, max_vertices)
+
+
+def gspan_to_igraph(gspan_content: str) -> list:
+    return list(iter_gspan_patterns(io.StringIO(gspan_content)))
+
+
+def nel_to_igraph(nel_content: str) -> list:
+    return list(iter_nel_patterns(io.StringIO(nel_content)))
+
+def gspan_command(filepath,
+                  support: float = 0.5,
+                  output_graph_ids: bool = True,
+                  output_discovered_patterns: bool = True,
+                  negative_data_filepath=None,
+                  input_pattern_filepath=None,
+                  output_dfs_codes: bool = False,
+                  min_length: int = None,
+                  lower_bound: float = None,
+                  num_threads: int = None
+                  ) -> list:
+    command = ['./gSpan6/gSpan', '-f', filepath, '-s', str(support)]
+    if negative_data_filepath:
+        command += ['-n', negative_data_filepath]
+    if input_pattern_filepath:
+        command += ['-p', input_pattern_filepath]
+    if output_discovered_patterns:
+        command += ['-o']
+    if output_graph_ids:
+        command += ['-i']
+    if output_dfs_codes:
+        command += ['-d']
+    if min_length is not None:
+        command += ['-m', str(min_length)]
+    if lower_bound is not None:
+        command += ['-v', str(lower_bound)]
+    if num_threads is not None:
+        command += ['-t', str(num_threads)]
+    return command
+
+
+def moss_command(filepath,
+                 output_filepath,
+                 support: int = 50,
+                 directed: bool = True,
+                 heap_size: int = 6,
+                 restrict_to_closed_substrucutres: bool = False,
+                 generate_all_possible_extensions: bool = True,
+                 maximum_substrucutre_size: int = 4
+                 ) -> list:
+    command = ['java']
+    if heap_size:
+        command += [f'-Xmx{heap_size}g']
+    command += ['-cp', 'dmoss/moss.jar', 'moss.Miner', '-inel', '-onel', '-x']
+    if directed:
+        command += ['-D']
+    command += ['-m2', f'-n{maximum_substrucutre_size}', f'-s{support}']
+    if not restrict_to_closed_substrucutres:
+        command += ['-C']
+    if generate_all_possible_extensions:
+        command += ['-A']
+    return command + [filepath, output_filepath]
+
+
+def gspan_job(filepath, output_path: str = '../data/fsm/subgraphs/', memory_limit: int = None, **kwargs) -> dict:
+    """
+    Returns a mining job for gSpan on filepath, see run_mining_jobs. gSpan writes its patterns next to its input,
+    the job moves them to output_path. memory_limit caps the address space of the miner in bytes.
+    kwargs are passed on to gspan_command.
+    """
+    return {
+        'name': os.path.basename(filepath),
+        'input': filepath,
+        'command': gspan_command(filepath, **kwargs),
+        'output': f'{filepath}.fp',
+        'destination': os.path.join(output_path, f'{os.path.basename(filepath)}.fp') if output_path is not None else None,
+        'format': 'gspan',
+        'memory': memory_limit,
+        'memory_limit': memory_limit
+    }
+
+
+def moss_job(filepath, output_path: str = '../data/fsm/subgraphs/', heap_size: int = 6, **kwargs) -> dict:
+    """
+    Returns a mining job for MoSS on filepath, see run_mining_jobs.
+    The JVM heap of heap_size GB counts against the memory budget of the runner.
+    MoSS writes to a temporary file that replaces the output once it succeeds. kwargs are passed on to moss_command.
+    """
+    output = os.path.join(output_path, f'{os.path.basename(filepath)}.moss')
+    return {
+        'name': os.path.basename(filepath),
+        'input': filepath,
+        'command': moss_command(filepath, output + '.tmp', heap_size=heap_size, **kwargs),
+        'output': output + '.tmp',
+        'destination': output,
+        'format': 'nel',
+        'memory': heap_size * 2 ** 30 if heap_size else None,
+        # the JVM reserves far more address space than its heap, so -Xmx is its limit
+        'memory_limit': None
+    }
+
+
+def get_job_patterns_path(job: dict) -> str:
+    # where the patterns of a job end up once it succeeds
+    return job.get('destination') or job['output']
+
+
+def get_job_command_path(job: dict) -> str:
+    # the command that mined the patterns of a job is kept next to them, see is_job_up_to_date
+    return get_job_patterns_path(job) + '.cmd'
+
+
+def is_up_to_date(filepath: str, *inputs: str) -> bool:
+    # filepath exists and was last written after every input
+    if not os.path.exists(filepath):
+        return False
+    mtime = os.path.getmtime(filepath)
+    return all(os.path.getmtime(input_path) < mtime for input_path in inputs)
+
+
+def is_job_up_to_date(job: dict) -> bool:
+    """
+    Returns whether the patterns of a job from gspan_job or moss_job are newer than its input and were mined with
+    the same command, support and size limits included, so mining again would only repeat them.
+    Jobs only move their patterns into place, and record their command, once the miner succeeds.
+    """
+    command_path = get_job_command_path(job)
+    if not is_up_to_date(get_job_patterns_path(job), job['input']) or not os.path.exists(command_path):
+        return False
+    with open(command_path, 'r') as f:
+        return json.load(f) == job['command']
+
+
+def follow_lines(filepath: str, process: subprocess.Popen, timeout: float = None, start: float = None, poll_interval: float = 0.1):
+    """
+    Yields the lines of filepath while process writes them, until the process has exited and the file is read.
+    Raises subprocess.TimeoutExpired timeout seconds after start, a time.monotonic() value that defaults to now.
+    """
+    deadline = (time.monotonic() if start is None else start) + timeout if timeout is not None else None
+
+    def check_deadline():
+        if deadline is not None and time.monotonic() > deadline:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+
+    while not os.path.exists(filepath):
+        if process.poll() is not None:
+            return
+        check_deadline()
+        time.sleep(poll_interval)
+
+    with open(filepath, 'r') as f:
+        partial = ''
+        while True:
+            line = f.readline()
+            if line.endswith('\n'):
+                yield partial + line
+                partial = ''
+            elif line:
+                # the miner is still writing this line
+                partial += line
+            elif process.poll() is not None:
+                # the miner has exited, so read what it wrote after the last read
+                yield from (partial + f.read()).splitlines(keepends=True)
+                return
+            else:
+                check_deadline()
+                time.sleep(poll_interval)
+
+
+def get_total_memory() -> int:
+    # physical memory of the machine in bytes, or None where the platform does not report it
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def limit_memory(command: list, memory_limit: int) -> list:
+    # wraps a command in a shell that caps its address space with ulimit -v (in KiB) before it starts the miner
+    return ['sh', '-c', f'ulimit -v {max(memory_limit // 1024, 1)} && exec "$@"', 'sh'] + list(command)
+
+
+def run_mining_job(job: dict, timeout: float = None, on_pattern=None, verbose: bool = False) -> dict:
+    """
+    Runs a mining job from gspan_job or moss_job and parses its patterns while the miner writes them.
+    on_pattern, if given, is called with the job name and every parsed pattern.
+    Raises subprocess.TimeoutExpired after timeout seconds and subprocess.CalledProcessError when the miner fails.
+    Returns the job name, run time in seconds, number of patterns and the output of the miner.
+    """
+    if verbose:
+        print(' '.join(job['command']))
+    if os.path.exists(job['output']):
+        os.remove(job['output'])
+
+    start = time.monotonic()
+    deadline = start + timeout if timeout is not None else None
+    command = limit_memory(job['command'], job['memory_limit']) if job.get('memory_limit') else job['command']
+    parse = iter_gspan_patterns if job['format'] == 'gspan' else iter_nel_patterns
+
+    # the miner's output goes to temporary files, so a full pipe can never block it
+    with tempfile.TemporaryFile('w+') as stdout, tempfile.TemporaryFile('w+') as stderr:
+        process = subprocess.Popen(command, stdout=stdout, stderr=stderr, text=True)
+        try:
+            patterns = 0
+            for pattern in parse(follow_lines(job['output'], process, timeout, start)):
+                patterns += 1
+                if on_pattern is not None:
+                    on_pattern(job['name'], pattern)
+            try:
+                process.wait(timeout=max(deadline - time.monotonic(), 0) if deadline is not None else None)
+            except subprocess.TimeoutExpired:
+                # report the timeout of the job, not the time that was left of it
+                raise subprocess.TimeoutExpired(job['command'], timeout) from None
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        stdout.seek(0)
+        stderr.seek(0)
+        output, errors = stdout.read(), stderr.read()
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, job['command'], output, errors)
+    if job.get('destination'):
+        os.replace(job['output'], job['destination'])
+    with atomic_write(get_job_command_path(job)) as temporary, open(temporary, 'w') as f:
+        json.dump(job['command'], f)
+
+    return {
+        'name': job['name'],
+        'seconds': time.monotonic() - start,
+        'patterns': patterns,
+        'stdout': output,
+        'stderr': errors
+    }
+
+
+def run_mining_jobs(jobs: list, max_jobs: int = None, memory_budget: int = None, timeout: float = None,
+                    on_pattern=None, verbose: bool = False) -> list:
+    """
+    Runs mining jobs concurrently, at most max_jobs at a time (one per core by default), and only as many as fit
+    in memory_budget bytes together. A job that needs more than the whole budget runs on its own.
+    Every job gets timeout seconds, see run_mining_job. Returns the results in the order of jobs.
+    """
+    max_jobs = max_jobs or os.cpu_count() or 1
+    available = {'memory': memory_budget}
+    condition = threading.Condition()
+
+    def run(job: dict) -> dict:
+        memory = min(job.get('memory') or 0, memory_budget) if memory_budget is not None else 0
+        with condition:
+            condition.wait_for(lambda: available['memory'] is None or available['memory'] >= memory)
+            if available['memory'] is not None:
+                available['memory'] -= memory
+        try:
+            return run_mining_job(job, timeout, on_pattern, verbose)
+        finally:
+            with condition:
+                if available['memory'] is not None:
+                    available['memory'] += memory
+                condition.notify_all()
+
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        return list(executor.map(run, jobs))
+
 
 def gspan(filepath, 
           support: float = 0.5, 
@@ -113,33 +488,14 @@ def gspan(filepath,
           lower_bound: float = None, 
           num_threads: int = None, 
           move_output_file: bool = True,
-          verbose: bool = False
-          ):
-    command = f'./gSpan6/gSpan -f {filepath} -s {support}'
-    if negative_data_filepath:
-        command += f' -n {negative_data_filepath}'
-    if input_pattern_filepath:
-        command += f' -p {input_pattern_filepath}'
-    if output_discovered_patterns:
-        command += ' -o'
-    if output_graph_ids:
-        command += ' -i'
-    if output_dfs_codes:
-        command += ' -d'
-    if min_length is not None:
-        command += f' -m {min_length}'
-    if lower_bound is not None:
-        command += f' -v {lower_bound}'
-    if num_threads is not None:
-        command += f' -t {num_threads}'
-    filename = os.path.basename(filepath)
-    if verbose:
-        print(command)
-    os.system(command)
-    
-    if move_output_file:
-        filename = os.path.basename(filepath)
-        os.rename(f'{filepath}.fp', f'../data/fsm/subgraphs/{filename}.fp')
+          verbose: bool = False,
+          timeout: float = None
+          ) -> dict:
+    job = gspan_job(filepath, output_path='../data/fsm/subgraphs/' if move_output_file else None,
+                    support=support, output_graph_ids=output_graph_ids, output_discovered_patterns=output_discovered_patterns,
+                    negative_data_filepath=negative_data_filepath, input_pattern_filepath=input_pattern_filepath,
+                    output_dfs_codes=output_dfs_codes, min_length=min_length, lower_bound=lower_bound, num_threads=num_threads)
+    return run_mining_job(job, timeout=timeout, verbose=verbose)
         
 def moss(filepath,
          support: int = 50,
@@ -148,17 +504,14 @@ def moss(filepath,
          restrict_to_closed_substrucutres: bool = False,
          generate_all_possible_extensions: bool = True,
          maximum_substrucutre_size: int = 4,
-         verbose: bool = False
-         ):
-    filename = os.path.basename(filepath)
-    heap_size = f'-Xmx{heap_size}g' if heap_size else ''
-    directed = '-D' if directed else ''
-    restrict_to_closed_substrucutres = '-C' if not restrict_to_closed_substrucutres else ''
-    generate_all_possible_extensions = '-A' if generate_all_possible_extensions else ''
-    command = f'java {heap_size} -cp dmoss/moss.jar moss.Miner -inel -onel -x {directed} -m2 -n{maximum_substrucutre_size} -s{support} {restrict_to_closed_substrucutres} {generate_all_possible_extensions} {filepath} ../data/fsm/subgraphs/{filename}.moss'
-    if verbose:
-        print(command)
-    os.system(command)
+         verbose: bool = False,
+         timeout: float = None
+         ) -> dict:
+    job = moss_job(filepath, heap_size=heap_size, support=support, directed=directed,
+                   restrict_to_closed_substrucutres=restrict_to_closed_substrucutres,
+                   generate_all_possible_extensions=generate_all_possible_extensions,
+                   maximum_substrucutre_size=maximum_substrucutre_size)
+    return run_mining_job(job, timeout=timeout, verbose=verbose)
 
 def json_to_igraph(json_content: list, directed: bool = True) -> list:
     graphs = []
@@ -171,4 +524,35 @@ def json_to_igraph(json_content: list, directed: bool = True) -> list:
         g['twitter_support'] = sub['twitter_support']
         g['conf_support'] = sub['conf_support']
         graphs.append(g)
-    return graphs
\ No newline at end of file
+    return graphs
+
+def read_checkpoint(filepath: str) -> list:
+    """
+    Returns the records of a JSONL checkpoint, one JSON object per line, or an empty list if there is none.
+    A last line left incomplete by an interrupted run is cut from the file, so records can be appended after it.
+    """
+    if not os.path.exists(filepath):
+        return []
+    records = []
+    end = 0
+    with open(filepath, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+            end += len(line)
+    if end < os.path.getsize(filepath):
+        os.truncate(filepath, end)
+    return records
+
+
+def get_graphs_fingerprint(graphs: list, edge_color: str = None) -> str:
+    # sha1 of the names, structure and edge colors of graphs, in order
+    sha1 = hashlib.sha1()
+    for g in graphs:
+        name = g['name'] if 'name' in g.attributes() else None
+        sha1.update(json.dumps([name, g.is_directed(), g.vcount(), g.get_edgelist(), g.es[edge_color] if edge_color is not None else None]).encode('utf-8'))
+    return sha1.hexdigest()
@@ -1,13 +1,24 @@
 import igraph as ig
 import numpy as np
-from scipy.sparse import lil_matrix
-import re
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import os
 import pickle
-import json
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+import hashlib
+from utils.sentiment_utils import score_texts, compound_to_label
+from utils.file_utils import atomic_write
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+
+# orjson is optional, but decodes the transcription files several times faster
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 # dict for sentiment labels
 sentiment_value_dict = defaultdict(lambda: 3, {
@@ -16,6 +27,17 @@ sentiment_value_dict = defaultdict(lambda: 3, {
     'negative': 2
 })
 
+# parsed edge tables are cached here, bump the version whenever load_edges changes its output
+edge_cache_path = '../data/cache/edges/'
+edge_cache_version = '1'
+
+# parquet copies of the pickled tweet files, see read_twitter_edges
+twitter_cache_path = '../data/cache/twitter/'
+
+# fields of the transcription files needed to attach sentiment to graphs, see load_sentiment
+sentiment_score_columns = ['pos', 'neg', 'neu', 'compound']
+sentiment_columns = ['video_id', 'stitchee_id', 'sentiment'] + sentiment_score_columns
+
 #################################################################
 #  _____ _ _  _____     _      _____                 _          #
 # |_   _(_) ||_   _|   | |    |  __ \               | |         #
@@ -67,22 +89,82 @@ hashtag_categories = uncapitalized_dict = {
 }
 
 def load_edges(filepath: str) -> pd.DataFrame:
-    # read edges from file
-    edges = pd.read_csv(filepath, header=None)
-
-    edges.columns = ['stitcher_url', 'stitchee_url']
-    edges = edges[edges['stitcher_url'].str.contains('None') == False]
-    edges = edges[edges['stitchee_url'].str.contains('None') == False]
-
-    edges['stitcher'] = edges['stitcher_url'].apply(lambda x: x.split('/')[-1]).astype(np.int64)
-    edges['stitchee'] = edges['stitchee_url'].apply(lambda x: x.split('/')[-1]).astype(np.int64)
-
-    expression = re.compile(r'@[\w\d\.]+')
-    edges['stitcher_user'] = edges['stitcher_url'].apply(lambda x: re.findall(expression, x)[0])
-    edges['stitchee_user'] = edges['stitchee_url'].apply(lambda x: re.findall(expression, x)[0])
+    # read raw url pairs with arrow's C++ csv reader, keeping 'None' as a string
+    table = pa_csv.read_csv(
+        filepath,
+        read_options=pa_csv.ReadOptions(column_names=['stitcher_url', 'stitchee_url']),
+        convert_options=pa_csv.ConvertOptions(column_types={'stitcher_url': pa.string(), 'stitchee_url': pa.string()}, strings_can_be_null=False)
+    )
+
+    # drop edges where either end is missing
+    mask = pc.and_(pc.not_equal(table['stitcher_url'], 'None'), pc.not_equal(table['stitchee_url'], 'None'))
+    table = table.filter(mask)
+
+    # urls look like https://www.tiktok.com/@user/video/id, splitting on '/' gives 6 parts with the user at 3 and the id at 5
+    columns = {}
+    for column in ['stitcher', 'stitchee']:
+        parts = pc.list_flatten(pc.split_pattern(table[f'{column}_url'], '/'))
+        if len(parts) != 6 * table.num_rows:
+            raise ValueError(f'Malformed video urls in {filepath}, clean it with misc/clean_edges.py')
+        columns[column] = pc.cast(parts.take(np.arange(5, len(parts), 6)), pa.int64())
+        columns[f'{column}_user'] = pc.dictionary_encode(parts.take(np.arange(3, len(parts), 6)))
+
+    edges = pa.Table.from_pydict(columns).to_pandas()
+    return edges
 
+def get_file_hash(filepath: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def load_edges_cached(filepath: str, cache_path: str = edge_cache_path) -> pd.DataFrame:
+    """
+    Loads edges like load_edges, but keeps the parsed table in an arrow file in cache_path.
+    The cache is keyed on the size, mtime and sha1 of the edge file, and is only rebuilt when the content changes.
+    """
+    cache_file = os.path.join(cache_path, os.path.basename(filepath) + '.arrow')
+    stat = os.stat(filepath)
+    size, mtime = str(stat.st_size), str(stat.st_mtime_ns)
+
+    file_hash = None
+    if os.path.exists(cache_file):
+        with pa.memory_map(cache_file, 'r') as source:
+            reader = pa.ipc.open_file(source)
+            metadata = {key.decode(): value.decode() for key, value in (reader.schema.metadata or {}).items()}
+            is_valid = metadata.get('edge_cache_version') == edge_cache_version and metadata.get('size') == size
+            is_touched = is_valid and metadata.get('mtime') != mtime
+            if is_touched:
+                # file was touched, only rebuild if the content actually changed
+                file_hash = get_file_hash(filepath)
+                is_valid = metadata.get('sha1') == file_hash
+            if is_valid:
+                table = reader.read_all()
+                if not is_touched:
+                    return table.to_pandas()
+        if is_valid:
+            # same content, store the new mtime so later loads skip the hash again
+            write_edge_cache(cache_file, table, size, mtime, file_hash)
+            return table.to_pandas()
+
+    edges = load_edges(filepath)
+    write_edge_cache(cache_file, pa.Table.from_pandas(edges, preserve_index=False), size, mtime, file_hash or get_file_hash(filepath))
     return edges
 
+def write_edge_cache(cache_file: str, table: pa.Table, size: str, mtime: str, file_hash: str) -> None:
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({
+        b'edge_cache_version': edge_cache_version.encode(),
+        b'size': size.encode(),
+        b'mtime': mtime.encode(),
+        b'sha1': file_hash.encode()
+    })
+    table = table.replace_schema_metadata(metadata)
+    with atomic_write(cache_file) as temporary, pa.OSFile(temporary, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
 def get_video_graph(edges: pd.DataFrame, directed=True) -> ig.Graph:
     G = ig.Graph.TupleList(edges[['stitcher', 'stitchee']].values, directed=directed)
     return G
@@ -91,119 +173,218 @@ def get_user_graph(edges: pd.DataFrame, directed=True) -> ig.Graph:
     G = ig.Graph.TupleList(edges[['stitcher_user', 'stitchee_user', 'stitcher', 'stitchee']].values, directed=directed, edge_attrs=['stitcher_id', 'stitchee_id'])
     return G
 
-def get_all_video_graphs(directed=True) -> list:
-    data_path = '../data/hashtags/edges/'
-    edge_files = [file for file in os.listdir(data_path) if file.endswith('.txt')]
-    edge_files.sort()
-    graphs = []
-    for edge_file in edge_files:
-        # read edge file
-        edge_file_path = os.path.join(data_path, edge_file)
-        edges = load_edges(edge_file_path)
-        g = get_video_graph(edges, directed=directed)
-        hashtag_name = edge_file.split('_')[0]
-        g['name'] = hashtag_name
-        g['category'] = hashtag_categories.get(hashtag_name, 'Other')
-        graphs.append(g)
-    return graphs
-
-def get_all_user_graphs(directed=True) -> list:
-    data_path = '../data/hashtags/edges/'
-    edge_files = [file for file in os.listdir(data_path) if file.endswith('.txt')]
-    edge_files.sort()
-    graphs = []
-    for edge_file in edge_files:
-        # read edge file
-        edge_file_path = os.path.join(data_path, edge_file)
-        edges = load_edges(edge_file_path)
-        g = get_user_graph(edges, directed=directed)
-        hashtag_name = edge_file.split('_')[0]
-        g['name'] = hashtag_name
-        g['category'] = hashtag_categories.get(hashtag_name, 'Other')
-        graphs.append(g)
-    return graphs
+def get_all_video_graphs(directed=True, workers: int = None) -> list:
+    return HashtagCorpus().video_graphs(directed=directed, workers=workers)
+
+def get_all_user_graphs(directed=True, workers: int = None) -> list:
+    return HashtagCorpus().user_graphs(directed=directed, workers=workers)
+
+def load_sentiment(filepath: str, columns: list = None) -> pd.DataFrame:
+    """
+    Streams a transcription jsonl file into columns, one line at a time. By default every top level field is kept,
+    if columns is given only those fields are, e.g. sentiment_columns to attach sentiment to graphs.
+    pos, neg, neu and compound are read from sentiment_scores. Ids are int64 columns, where a missing id is -1.
+    """
+    data = {}
+    rows = 0
+
+    def add_column(column: str) -> None:
+        # columns first seen after some rows are filled with missing values for those rows
+        if column in ['video_id', 'stitchee_id']:
+            data[column] = array('q', [-1] * rows)
+        elif column in sentiment_score_columns:
+            data[column] = array('d', [np.nan] * rows)
+        else:
+            data[column] = [None] * rows
+
+    for column in columns or []:
+        add_column(column)
 
-def load_sentiment(filepath: str) -> pd.DataFrame:
-    data = []
-    with open(filepath, 'r') as f:
+    with open(filepath, 'rb') as f:
         for line in f:
-            line_data = json.loads(line)
-            line_data['stitchee_id'] = -1 if line_data['stitchee_id'] is None else line_data['stitchee_id']
-            line_data['pos'] = line_data['sentiment_scores']['pos'] if line_data['sentiment_scores'] is not None else None
-            line_data['neg'] = line_data['sentiment_scores']['neg'] if line_data['sentiment_scores'] is not None else None
-            line_data['neu'] = line_data['sentiment_scores']['neu'] if line_data['sentiment_scores'] is not None else None
-            line_data['compound'] = line_data['sentiment_scores']['compound'] if line_data['sentiment_scores'] is not None else None
-            data.append(line_data)
-            
-    df = pd.DataFrame(data)
+            if not line.strip():
+                continue
+            line_data = json_loads(line)
+            if columns is None:
+                for column in [*line_data, *sentiment_score_columns]:
+                    if column not in data:
+                        add_column(column)
+            scores = line_data.get('sentiment_scores') or {}
+            for column, values in data.items():
+                if column in sentiment_score_columns:
+                    value = scores.get(column)
+                    values.append(np.nan if value is None else value)
+                elif column in ['video_id', 'stitchee_id']:
+                    value = line_data.get(column)
+                    values.append(-1 if value is None else value)
+                else:
+                    values.append(line_data.get(column))
+            rows += 1
+
+    df = pd.DataFrame({
+        column: np.frombuffer(values, dtype=np.int64 if values.typecode == 'q' else np.float64) if isinstance(values, array) else values
+        for column, values in data.items()
+    })
     return df
 
+def lookup_sentiment(sentiment: pd.DataFrame, ids) -> tuple:
+    """
+    Looks up the sentiment label, compound score and sentiment value of every video id in ids.
+    Transcriptions of stitchers are keyed on the stitchee id, and the last transcription of an id wins.
+    Ids without a transcription get the label 'no transcription' and a None score.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    sentiment_ids = np.where(sentiment['stitchee_id'].values == -1, sentiment['video_id'].values, sentiment['stitchee_id'].values).astype(np.int64)
+
+    # sorted unique ids, pointing at the last row of each id
+    order = np.argsort(sentiment_ids, kind='stable')
+    sorted_ids = sentiment_ids[order]
+    is_last = np.append(sorted_ids[1:] != sorted_ids[:-1], True) if len(sorted_ids) > 0 else np.zeros(0, dtype=bool)
+    keys = sorted_ids[is_last]
+    rows = order[is_last]
+
+    labels = np.full(len(ids), 'no transcription', dtype=object)
+    scores = np.full(len(ids), None, dtype=object)
+    if len(keys) > 0:
+        positions = np.minimum(np.searchsorted(keys, ids), len(keys) - 1)
+        found = keys[positions] == ids
+        matched_rows = rows[positions[found]]
+        labels[found] = np.array(sentiment['sentiment'].tolist(), dtype=object)[matched_rows]
+        scores[found] = np.array(sentiment['compound'].tolist(), dtype=object)[matched_rows]
+
+    values = np.full(len(ids), sentiment_value_dict.default_factory())
+    for label, value in sentiment_value_dict.items():
+        values[labels == label] = value
+
+    return labels.tolist(), scores.tolist(), values.tolist()
+
 def get_sentiment_video_graph(edges: pd.DataFrame, sentiment: pd.DataFrame, directed=True) -> list:
     g = get_video_graph(edges, directed=directed)
-    sentiment['id'] = sentiment.apply(lambda x: x['video_id'] if x['stitchee_id'] == -1 else x['stitchee_id'], axis=1)
-    sentiment_dict = sentiment.set_index('id')['sentiment'].to_dict()
-    g.vs['sentiment'] = [sentiment_dict.get(v['name'], 'no transcription') for v in g.vs]
-    score_dict = sentiment.set_index('id')['compound'].to_dict()
-    g.vs['score'] = [score_dict.get(v['name'], None) for v in g.vs]
-    g.vs['sentiment_value'] = [sentiment_value_dict[s] for s in g.vs['sentiment']]
+    g.vs['sentiment'], g.vs['score'], g.vs['sentiment_value'] = lookup_sentiment(sentiment, g.vs['name'])
     return g
 
 def get_sentiment_user_graph(edges: pd.DataFrame, sentiment: pd.DataFrame, directed=True) -> ig.Graph:
     g = get_user_graph(edges, directed=directed)
-    
-    sentiment['id'] = sentiment.apply(lambda x: x['video_id'] if x['stitchee_id'] == -1 else x['stitchee_id'], axis=1)
-    sentiment_dict = sentiment.set_index('id')['sentiment'].to_dict()
-    g.es['stitcher_sentiment'] = [sentiment_dict.get(e['stitcher_id'], 'no transcription') for e in g.es]
-    g.es['stitchee_sentiment'] = [sentiment_dict.get(e['stitchee_id'], 'no transcription') for e in g.es]
-    g.es['stitcher_sentiment_value'] = [sentiment_value_dict[s] for s in g.es['stitcher_sentiment']]
-    g.es['stitchee_sentiment_value'] = [sentiment_value_dict[s] for s in g.es['stitchee_sentiment']]
-    
-    score_dict = sentiment.set_index('id')['compound'].to_dict()
-    g.es['stitcher_score'] = [score_dict.get(e['stitcher_id'], None) for e in g.es]
-    g.es['stitchee_score'] = [score_dict.get(e['stitchee_id'], None) for e in g.es]
-    
+    g.es['stitcher_sentiment'], g.es['stitcher_score'], g.es['stitcher_sentiment_value'] = lookup_sentiment(sentiment, g.es['stitcher_id'])
+    g.es['stitchee_sentiment'], g.es['stitchee_score'], g.es['stitchee_sentiment_value'] = lookup_sentiment(sentiment, g.es['stitchee_id'])
     return g
     
-def get_all_sentiment_video_graphs(directed=True) -> list:
-    edge_path = '../data/hashtags/edges/'
-    sentiment_path = '../data/hashtags/transcriptions/'
-    edge_files = {file.split('_')[0]: file for file in os.listdir(edge_path) if file.endswith('.txt')}
-    sentiment_files = {file.split('_')[0]: file for file in os.listdir(sentiment_path) if file.endswith('.jsonl')}
-    common_keys = list(set(edge_files.keys()).intersection(set(sentiment_files.keys())))
-    common_keys.sort()
+def get_all_sentiment_video_graphs(directed=True, workers: int = None) -> list:
+    return HashtagCorpus().sentiment_video_graphs(directed=directed, workers=workers)
     
-    graphs = []
-    for hashtag in common_keys:
-        edge_file_path = os.path.join(edge_path, edge_files[hashtag])
-        edges = load_edges(edge_file_path)
-        sentiment_file_path = os.path.join(sentiment_path, sentiment_files[hashtag])
-        sentiment = load_sentiment(sentiment_file_path)
+def get_all_sentiment_user_graphs(directed=True, workers: int = None) -> list:
+    return HashtagCorpus().sentiment_user_graphs(directed=directed, workers=workers)
+
+
+class HashtagCorpus:
+    """
+    Loads the edges and transcriptions of each hashtag at most once, and builds video, user and
+    sentiment graphs from them on demand. Graphs are rebuilt on every call, so callers are free to modify them.
+    """
+    def __init__(self, edge_path: str = '../data/hashtags/edges/', sentiment_path: str = '../data/hashtags/transcriptions/') -> None:
+        self.edge_path = edge_path
+        self.sentiment_path = sentiment_path
+        self.edge_files = {file.split('_')[0]: file for file in os.listdir(edge_path) if file.endswith('.txt')}
+        self.sentiment_files = {file.split('_')[0]: file for file in os.listdir(sentiment_path) if file.endswith('.jsonl')} if os.path.isdir(sentiment_path) else {}
+        self.hashtags = sorted(self.edge_files.keys())
+        self.sentiment_hashtags = sorted(set(self.edge_files.keys()).intersection(self.sentiment_files.keys()))
+        self._edges = {}
+        self._sentiment = {}
+
+    def edges(self, hashtag: str) -> pd.DataFrame:
+        if hashtag not in self._edges:
+            self._edges[hashtag] = load_edges_cached(os.path.join(self.edge_path, self.edge_files[hashtag]))
+        return self._edges[hashtag]
+
+    def sentiment(self, hashtag: str) -> pd.DataFrame:
+        if hashtag not in self.sentiment_files:
+            raise ValueError(f'No transcriptions found for {hashtag}')
+        if hashtag not in self._sentiment:
+            self._sentiment[hashtag] = load_sentiment(os.path.join(self.sentiment_path, self.sentiment_files[hashtag]), sentiment_columns)
+        return self._sentiment[hashtag]
+
+    def video_graph(self, hashtag: str, directed=True) -> ig.Graph:
+        return build_corpus_graph('video', hashtag, self.edges(hashtag), None, directed)
+
+    def user_graph(self, hashtag: str, directed=True) -> ig.Graph:
+        return build_corpus_graph('user', hashtag, self.edges(hashtag), None, directed)
+
+    def sentiment_video_graph(self, hashtag: str, directed=True) -> ig.Graph:
+        return build_corpus_graph('sentiment_video', hashtag, self.edges(hashtag), self.sentiment(hashtag), directed)
+
+    def sentiment_user_graph(self, hashtag: str, directed=True) -> ig.Graph:
+        return build_corpus_graph('sentiment_user', hashtag, self.edges(hashtag), self.sentiment(hashtag), directed)
+
+    def _graphs(self, view: str, hashtags: list, directed: bool, workers: int) -> list:
+        if workers is None or workers <= 1:
+            return [getattr(self, f'{view}_graph')(hashtag, directed=directed) for hashtag in hashtags]
+
+        # build graphs in worker processes, which send back plain edge and attribute arrays instead of pickled graphs.
+        # Tables loaded here already are sent along, the others are read by the workers, edges through the shared arrow cache
+        if view.startswith('sentiment') and any(hashtag not in self.sentiment_files for hashtag in hashtags):
+            raise ValueError('No transcriptions found for some hashtags')
+        tasks = [(
+            view, hashtag,
+            self._edges.get(hashtag, os.path.join(self.edge_path, self.edge_files[hashtag])),
+            self._sentiment.get(hashtag, os.path.join(self.sentiment_path, self.sentiment_files[hashtag])) if view.startswith('sentiment') else None,
+            directed
+        ) for hashtag in hashtags]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return [graph_from_arrays(arrays) for arrays in executor.map(build_corpus_graph_arrays, tasks)]
+
+    def video_graphs(self, directed=True, workers: int = None) -> list:
+        return self._graphs('video', self.hashtags, directed, workers)
+
+    def user_graphs(self, directed=True, workers: int = None) -> list:
+        return self._graphs('user', self.hashtags, directed, workers)
+
+    def sentiment_video_graphs(self, directed=True, workers: int = None) -> list:
+        return self._graphs('sentiment_video', self.sentiment_hashtags, directed, workers)
+
+    def sentiment_user_graphs(self, directed=True, workers: int = None) -> list:
+        return self._graphs('sentiment_user', self.sentiment_hashtags, directed, workers)
+
+def graph_to_arrays(g: ig.Graph) -> dict:
+    return {
+        'directed': g.is_directed(),
+        'n': g.vcount(),
+        'edges': np.array(g.get_edgelist(), dtype=np.int64).reshape(-1, 2),
+        'graph_attrs': {attr: g[attr] for attr in g.attributes()},
+        'vertex_attrs': {attr: g.vs[attr] for attr in g.vs.attributes()},
+        'edge_attrs': {attr: g.es[attr] for attr in g.es.attributes()}
+    }
+
+def graph_from_arrays(arrays: dict) -> ig.Graph:
+    return ig.Graph(
+        n=arrays['n'],
+        edges=arrays['edges'],
+        directed=arrays['directed'],
+        graph_attrs=arrays['graph_attrs'],
+        vertex_attrs=arrays['vertex_attrs'],
+        edge_attrs=arrays['edge_attrs']
+    )
+
+def build_corpus_graph(view: str, hashtag: str, edges: pd.DataFrame, sentiment: pd.DataFrame, directed: bool) -> ig.Graph:
+    if view == 'video':
+        g = get_video_graph(edges, directed=directed)
+    elif view == 'user':
+        g = get_user_graph(edges, directed=directed)
+    elif view == 'sentiment_video':
         g = get_sentiment_video_graph(edges, sentiment, directed=directed)
-        g['name'] = hashtag
-        g['category'] = hashtag_categories.get(hashtag, 'Other')
-        graphs.append(g)
-    return graphs
-    
-def get_all_sentiment_user_graphs(directed=True) -> list:
-    edge_path = '../data/hashtags/edges/'
-    sentiment_path = '../data/hashtags/transcriptions/'
-    edge_files = {file.split('_')[0]: file for file in os.listdir(edge_path) if file.endswith('.txt')}
-    sentiment_files = {file.split('_')[0]: file for file in os.listdir(sentiment_path) if file.endswith('.jsonl')}
-    common_keys = list(set(edge_files.keys()).intersection(set(sentiment_files.keys())))
-    common_keys.sort()
-    
-    graphs = []
-    for hashtag in common_keys:
-        edge_file_path = os.path.join(edge_path, edge_files[hashtag])
-        edges = load_edges(edge_file_path)
-        sentiment_file_path = os.path.join(sentiment_path, sentiment_files[hashtag])
-        sentiment = load_sentiment(sentiment_file_path)
+    else:
         g = get_sentiment_user_graph(edges, sentiment, directed=directed)
-        g['name'] = hashtag
-        g['category'] = hashtag_categories.get(hashtag, 'Other')
-        graphs.append(g)
-    return graphs
+    g['name'] = hashtag
+    g['category'] = hashtag_categories.get(hashtag, 'Other')
+    return g
 
+def build_corpus_graph_arrays(task: tuple) -> dict:
+    # runs in a worker process, see HashtagCorpus._graphs, with each table either loaded already or a file to load
+    view, hashtag, edges, sentiment, directed = task
+    if isinstance(edges, str):
+        edges = load_edges_cached(edges)
+    if isinstance(sentiment, str):
+        sentiment = load_sentiment(sentiment, sentiment_columns)
+    return graph_to_arrays(build_corpus_graph(view, hashtag, edges, sentiment, directed))
 
 #######################################################################
 #  _____        _ _   _              _____                 _          #
@@ -216,74 +397,94 @@ def get_all_sentiment_user_graphs(directed=True) -> list:
 #                                                   |_|               #
 #######################################################################
 
-def load_twitter_edges(filepath: str) -> ig.Graph:
-    # read json object from pickle
+# schema of the converted twitter reply edges, ids are kept as exact int64 instead of float
+twitter_edge_schema = pa.schema([
+    ('tweet_id', pa.int64()),
+    ('user_id', pa.int64()),
+    ('in_reply_to_tweet_id', pa.int64()),
+    ('in_reply_to_user_id', pa.int64()),
+    ('is_retweet', pa.bool_()),
+    ('is_quote', pa.bool_()),
+    ('text', pa.string())
+])
+twitter_graph_columns = ['user_id', 'in_reply_to_user_id', 'tweet_id', 'is_retweet', 'is_quote']
+
+def convert_twitter_edges(filepath: str, output_filepath: str = None, batch_size: int = 100_000) -> str:
+    """
+    One-time conversion of a pickled list of tweets into a parquet file holding only the reply edges.
+    Tweets are written in row groups of batch_size, so readers can later load single columns.
+    """
+    output_filepath = os.path.join(twitter_cache_path, os.path.basename(filepath) + '.parquet') if output_filepath is None else output_filepath
     with open(filepath, 'rb') as f:
         tweets = pickle.load(f)
-    
-    # extract edges from tweets
-    data = [
-        {
-            'tweet_id': tweet['id'],
-            'user_id': tweet['user']['id'],
-            'in_reply_to_tweet_id': tweet['in_reply_to_status_id'],
-            'in_reply_to_user_id': tweet['in_reply_to_user_id'],
-            'is_retweet': tweet['retweeted'],
-            'is_quote': tweet['is_quote_status'],
-            'text': tweet['text']
-        }
-        for tweet in tweets
-    ]
-
-    df = pd.DataFrame(data)
-    df = df[df['in_reply_to_user_id'].notnull()]
-    return df
+
+    with atomic_write(output_filepath) as temporary, pq.ParquetWriter(temporary, twitter_edge_schema) as writer:
+        for start in range(0, len(tweets), batch_size):
+            replies = [tweet for tweet in tweets[start:start + batch_size] if tweet['in_reply_to_user_id'] is not None]
+            batch = pa.table({
+                'tweet_id': [tweet['id'] for tweet in replies],
+                'user_id': [tweet['user']['id'] for tweet in replies],
+                'in_reply_to_tweet_id': [tweet['in_reply_to_status_id'] for tweet in replies],
+                'in_reply_to_user_id': [tweet['in_reply_to_user_id'] for tweet in replies],
+                'is_retweet': [tweet['retweeted'] for tweet in replies],
+                'is_quote': [tweet['is_quote_status'] for tweet in replies],
+                'text': [tweet['text'] for tweet in replies]
+            }, schema=twitter_edge_schema)
+            writer.write_table(batch)
+    return output_filepath
+
+def read_twitter_edges(filepath: str, columns: list = None, cache_path: str = twitter_cache_path) -> pd.DataFrame:
+    """
+    Reads the requested columns of the reply edges of a pickled tweet file, or all columns if columns is None.
+    The edges are read from a parquet copy in cache_path, which is (re)built when missing or older than the pickle.
+    Ids stay exact, with pandas' nullable Int64 where a reply has no tweet id.
+    """
+    parquet_filepath = os.path.join(cache_path, os.path.basename(filepath) + '.parquet')
+    if not os.path.exists(parquet_filepath) or os.path.getmtime(parquet_filepath) < os.path.getmtime(filepath):
+        convert_twitter_edges(filepath, parquet_filepath)
+    return pq.read_table(parquet_filepath, columns=columns, memory_map=True).to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+def get_twitter_files(data_path: str = '../data/twitter/') -> list:
+    return [os.path.join(data_path, file) for file in sorted(os.listdir(data_path)) if file.endswith('_tweets')]
 
 def get_twitter_user_graph(edges: pd.DataFrame, directed=True) -> ig.Graph:
-    # create directed graph
-    G = ig.Graph.TupleList(edges[['user_id', 'in_reply_to_user_id', 'tweet_id', 'is_retweet', 'is_quote', 'text']].values, directed=directed, edge_attrs=['tweet_id', 'is_retweet', 'is_quote', 'text'])
+    # create directed graph, text is only attached when it was loaded
+    edge_attrs = [column for column in ['tweet_id', 'is_retweet', 'is_quote', 'text'] if column in edges.columns]
+    G = ig.Graph.TupleList(edges[['user_id', 'in_reply_to_user_id'] + edge_attrs].values, directed=directed, edge_attrs=edge_attrs)
     G['category'] = 'Twitter'
     return G
     
 def get_all_twitter_user_graphs(directed=True) -> list:
-    data_path = '../data/twitter/'
-    edge_files = [file for file in os.listdir(data_path) if file.endswith('_tweets')]
     graphs = []
-    for edge_file in edge_files:
-        # read edge file
-        edge_file_path = os.path.join(data_path, edge_file)
-        edges = load_twitter_edges(edge_file_path)
+    for edge_file_path in get_twitter_files():
+        # read edge file, skipping the tweet texts
+        edges = read_twitter_edges(edge_file_path, columns=twitter_graph_columns)
         g = get_twitter_user_graph(edges, directed=directed)
-        g['name'] = edge_file.split('_')[0] + '_twitter'
+        g['name'] = os.path.basename(edge_file_path).split('_')[0] + '_twitter'
         graphs.append(g)
     return graphs
 
-def get_twitter_sentiment_user_graph(edges: pd.DataFrame, directed=True) -> ig.Graph:
+def get_twitter_sentiment_user_graph(edges: pd.DataFrame, directed=True, workers: int = None) -> ig.Graph:
     # create directed graph
     G = get_twitter_user_graph(edges, directed=directed)
-    analyzer = SentimentIntensityAnalyzer()
-    sentiment_score = [analyzer.polarity_scores(text) for text in edges['text']]
+    sentiment_score = score_texts(edges['text'], workers=workers)
     compound = [s['compound'] for s in sentiment_score]
-    labels = ['positive' if c > 0.05 else 'negative' if c < -0.05 else 'neutral' for c in compound]
+    labels = [compound_to_label(c) for c in compound]
     G.es['sentiment'] = labels
     G.es['sentiment_value'] = [sentiment_value_dict[s] for s in labels]
     G.es['score'] = compound
     return G
 
-def get_all_twitter_sentiment_user_graphs(directed=True) -> list:
-    data_path = '../data/twitter/'
-    edge_files = [file for file in os.listdir(data_path) if file.endswith('_tweets')]
+def get_all_twitter_sentiment_user_graphs(directed=True, workers: int = None) -> list:
     graphs = []
-    for edge_file in edge_files:
+    for edge_file_path in get_twitter_files():
         # read edge file
-        edge_file_path = os.path.join(data_path, edge_file)
-        edges = load_twitter_edges(edge_file_path)
-        g = get_twitter_sentiment_user_graph(edges, directed=directed)
-        g['name'] = edge_file.split('_')[0] + '_twitter'
+        edges = read_twitter_edges(edge_file_path, columns=twitter_graph_columns + ['text'])
+        g = get_twitter_sentiment_user_graph(edges, directed=directed, workers=workers)
+        g['name'] = os.path.basename(edge_file_path).split('_')[0] + '_twitter'
         graphs.append(g)
     return graphs
 
-
 ###########################################################################
 #  _____                 _       _____ _        _   _     _   _           #
 # |  __ \               | |     /  ___| |      | | (_)   | | (_)          #
@@ -295,37 +496,17 @@ def get_all_twitter_sentiment_user_graphs(directed=True) -> list:
 #                 |_|                                                     #
 ###########################################################################
 
-def degree_centralization(G: ig.Graph) -> float:
-    if G.is_directed():
-        raise ValueError('Centralization is only defined for undirected graphs')
+# components with more vertices than this get sampled closeness and betweenness centralization
+centralization_sample_threshold = 5000
+centralization_sample_size = 500
+centralization_sample_batches = 10
+centralization_seed = 0
 
-    if G.vcount() < 3:
-        raise ValueError('Centralization is only defined for graphs with at least 3 vertices')
+# number of vertex pairs project_graph generates at a time
+projection_chunk_size = 1_000_000
 
-    if not G.is_simple():
-        raise ValueError('Centralization is only defined for simple graphs')
 
-    if G.ecount() == 0:
-        raise ValueError('Centralization is only defined for graphs with at least 1 edge')
-    
-    num_nodes = len(G.vs)
-    star = ig.Graph.Star(num_nodes, mode = 'undirected')
-
-    degrees = np.array(G.degree())
-    degrees_star = np.array(star.degree())
-
-    max_degree = np.max(degrees)
-    max_degree_star = np.max(degrees_star)
-
-    centrality = max_degree - degrees
-    centrality_star = max_degree_star - degrees_star
-    #used to be: np.where(degrees_star > 0, max_degree_star - degrees_star, 0)
-    degree_centralization = np.sum(centrality) / np.sum(centrality_star)
-    
-    return degree_centralization
-
-
-def closeness_centralization(G: ig.Graph) -> float:
+def check_centralization_graph(G: ig.Graph) -> None:
     if G.is_directed():
         raise ValueError('Centralization is only defined for undirected graphs')
 
@@ -337,63 +518,263 @@ def closeness_centralization(G: ig.Graph) -> float:
 
     if G.ecount() == 0:
         raise ValueError('Centralization is only defined for graphs with at least 1 edge')
-    
-    num_nodes = len(G.vs)
-    star = ig.Graph.Star(num_nodes, mode = 'undirected')
 
-    closeness = np.array(G.closeness())
-    closeness_star = np.array(star.closeness())
-    
-
-    max_closeness = np.max(closeness)
-    max_closeness_star = np.max(closeness_star)
-
-
-    centrality = max_closeness - closeness
-    centrality_star = max_closeness_star - closeness_star
-    closeness_centralization = np.sum(centrality) / np.sum(centrality_star)
-    
-    return closeness_centralization
-
-def betweenness_centralization(G: ig.Graph) -> float:
-    if G.is_directed():
-        raise ValueError('Centralization is only defined for undirected graphs')
-    if G.vcount() < 3:
-        raise ValueError('Centralization is only defined for graphs with at least 3 vertices')
-    if not G.is_simple():
-        raise ValueError('Centralization is only defined for simple graphs')
-    if G.ecount() == 0:
-        raise ValueError('Centralization is only defined for graphs with at least 1 edge')
-    
 
-    num_nodes = len(G.vs)
-    star = ig.Graph.Star(num_nodes, mode = 'undirected')
+# Total deviation from the most central vertex in an undirected star with n vertices, which is the
+# maximum over all graphs with n vertices. These are the denominators of the centralization scores.
+def star_degree_deviation(n: int) -> float:
+    # centre has degree n - 1, the n - 1 leaves have degree 1
+    return (n - 1) * (n - 2)
 
-    betweenness = np.array(G.betweenness())
-    betweenness_star = np.array(star.betweenness())
 
-    max_betweenness = np.max(betweenness)
-    max_betweenness_star = np.max(betweenness_star)
+def star_closeness_deviation(n: int) -> float:
+    # normalized closeness of the centre is 1, leaves are at distance 1 from the centre
+    # and 2 from the other n - 2 leaves, so their closeness is (n - 1) / (2n - 3)
+    return (n - 1) * (n - 2) / (2 * n - 3)
 
-    centrality = max_betweenness - betweenness
-    centrality_star = max_betweenness_star - betweenness_star
 
+def star_betweenness_deviation(n: int) -> float:
+    # the centre lies on the shortest path between every pair of leaves, leaves lie on none
+    return (n - 1) * (n - 1) * (n - 2) / 2
 
-    betweenness_centralization = np.sum(centrality) / np.sum(centrality_star)
 
+def degree_centralization(G: ig.Graph) -> float:
+    check_centralization_graph(G)
 
-    return betweenness_centralization    
-
+    degrees = np.array(G.degree())
+    centrality = np.max(degrees) - degrees
+    degree_centralization = np.sum(centrality) / star_degree_deviation(G.vcount())
+    
+    return degree_centralization
 
-def project_graph(G: ig.Graph) -> ig.Graph:
-    A = G.get_adjacency_sparse()
-    A_proj = A @ A.T
-    A_proj = lil_matrix(A_proj)  # Convert to lil_matrix for efficient modification
-    A_proj.setdiag(0)  # Set diagonal to 0
-    A_proj = A_proj.tocsr()  # Convert back to csr_matrix for efficient operations
-    G_proj = ig.Graph.Adjacency(A_proj, mode='undirected')
-    return G_proj
 
+def closeness_centralization(G: ig.Graph, sample_size: int = None, seed: int = centralization_seed,
+                             threshold: int = centralization_sample_threshold) -> float:
+    return closeness_centralization_with_error(G, sample_size, seed, threshold)[0]
+
+
+def betweenness_centralization(G: ig.Graph, sample_size: int = None, seed: int = centralization_seed,
+                               threshold: int = centralization_sample_threshold) -> float:
+    return betweenness_centralization_with_error(G, sample_size, seed, threshold)[0]
+
+
+def closeness_centralization_with_error(G: ig.Graph, sample_size: int = None, seed: int = centralization_seed,
+                                        threshold: int = centralization_sample_threshold) -> tuple:
+    """
+    Returns the closeness centralization of G and its standard error.
+    Graphs with more than threshold vertices, or any graph when sample_size is given, get a sampled estimate,
+    smaller graphs get the exact value with an error of 0.
+    """
+    check_centralization_graph(G)
+
+    if sample_size is None and G.vcount() <= threshold:
+        closeness = np.array(G.closeness())
+        centrality = np.max(closeness) - closeness
+        return np.sum(centrality) / star_closeness_deviation(G.vcount()), 0.0
+
+    return estimate_centralization(G, 'closeness', sample_size or centralization_sample_size, seed)
+
+
+def betweenness_centralization_with_error(G: ig.Graph, sample_size: int = None, seed: int = centralization_seed,
+                                          threshold: int = centralization_sample_threshold) -> tuple:
+    """
+    Returns the betweenness centralization of G and its standard error.
+    Graphs with more than threshold vertices, or any graph when sample_size is given, get a sampled estimate,
+    smaller graphs get the exact value with an error of 0.
+    """
+    check_centralization_graph(G)
+
+    if sample_size is None and G.vcount() <= threshold:
+        betweenness = np.array(G.betweenness())
+        centrality = np.max(betweenness) - betweenness
+        return np.sum(centrality) / star_betweenness_deviation(G.vcount()), 0.0
+
+    return estimate_centralization(G, 'betweenness', sample_size or centralization_sample_size, seed)
+
+
+def estimate_centralization(G: ig.Graph, metric: str, sample_size: int = centralization_sample_size,
+                            seed: int = centralization_seed, batches: int = centralization_sample_batches) -> tuple:
+    """
+    Estimates the closeness or betweenness centralization of G from the shortest paths out of about sample_size
+    random source vertices, and returns the estimate with its standard error.
+    Every component gets sources in proportion to its size. Components whose share is all their vertices, or
+    fewer than one source per batch, are computed exactly and add no error.
+    Betweenness is the Brandes k-source estimate, scaled up per component by its size / its sources. Closeness
+    averages each vertex's distance to the sampled sources of its component instead of to all its vertices.
+    The sources of each component are split into batches, and the spread of the per-batch estimates gives the
+    standard error. The maximum of the sampled values is above the true maximum on average, so the estimate is
+    biased slightly upwards, by less than the standard error for the default sample.
+    """
+    n = G.vcount()
+    rng = np.random.default_rng(seed)
+    batches = max(batches, 1)
+    membership = np.array(G.connected_components().membership)
+    sizes = np.bincount(membership)
+    shares = np.minimum(np.round(sample_size * sizes / n).astype(int), sizes)
+    sampled = (shares >= batches) & (shares < sizes)
+
+    # the exact part is computed once and added to every batch
+    exact_vertices = np.flatnonzero(~sampled[membership])
+    parts = [np.array_split(rng.choice(np.flatnonzero(membership == component), size=shares[component], replace=False), batches)
+             for component in np.flatnonzero(sampled)]
+    source_batches = [np.concatenate(batch) for batch in zip(*parts)]
+
+    if metric == 'betweenness':
+        deviation = star_betweenness_deviation(n)
+        exact = np.array(G.betweenness(sources=exact_vertices.tolist())) if len(exact_vertices) else np.zeros(n)
+        batch_sums = [np.array(G.betweenness(sources=batch.tolist())) for batch in source_batches]
+        batch_shares = [np.bincount(membership[batch], minlength=len(sizes)) for batch in source_batches]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            batch_values = [np.where(sampled[membership], batch_sum * sizes[membership] / batch_share[membership], exact)
+                            for batch_sum, batch_share in zip(batch_sums, batch_shares)]
+            values = np.where(sampled[membership], np.sum(batch_sums, axis=0) * sizes[membership] / shares[membership], exact)
+    elif metric == 'closeness':
+        # same normalisation as G.closeness(), only reachable vertices count, and isolated vertices make it nan
+        if min(G.degree()) == 0:
+            return np.nan, np.nan
+        deviation = star_closeness_deviation(n)
+        exact = np.full(n, np.nan)
+        exact[exact_vertices] = G.closeness(vertices=exact_vertices.tolist())
+        batch_sums, batch_counts = [], []
+        for batch in source_batches:
+            distances = np.array(G.distances(source=batch.tolist()))
+            reachable = np.isfinite(distances) & (distances > 0)
+            batch_sums.append(np.where(reachable, distances, 0).sum(axis=0))
+            batch_counts.append(reachable.sum(axis=0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            batch_values = [np.where(sampled[membership], counts / sums, exact) for counts, sums in zip(batch_counts, batch_sums)]
+            values = np.where(sampled[membership], np.sum(batch_counts, axis=0) / np.sum(batch_sums, axis=0), exact) \
+                if source_batches else exact
+    else:
+        raise ValueError(f'No sampled estimate for {metric} centralization')
+
+    # a vertex that is the only source of its component in a batch has no sampled distances, so skip those
+    estimate = np.nansum(np.nanmax(values) - values) / deviation
+    if not source_batches:
+        return estimate, 0.0
+    if len(source_batches) < 2:
+        return estimate, np.nan
+    batch_estimates = [np.nansum(np.nanmax(v) - v) / deviation for v in batch_values]
+    error = np.std(batch_estimates, ddof=1) / np.sqrt(len(batch_estimates))
+    return estimate, error
+
+
+def component_centralizations(G: ig.Graph, components: ig.VertexClustering = None,
+                              metrics: list = ['degree', 'closeness', 'betweenness'], lcc_only: bool = False,
+                              sample_size: int = None, seed: int = centralization_seed) -> list:
+    """
+    Computes the requested centralizations of every component of the simple undirected graph G with at least
+    3 vertices, extracting each component only once. Pass the components of G if they are already known.
+    Returns one dict per component, largest first, with its size and a (value, error) tuple per metric.
+    With lcc_only, only the largest component is computed.
+    """
+    if components is None:
+        components = G.components()
+    sizes = np.array(components.sizes())
+
+    # stable sort, so ties keep the component order of G.components()
+    order = [i for i in np.argsort(-sizes, kind='stable') if sizes[i] > 2]
+    if lcc_only:
+        order = order[:1]
+
+    results = []
+    for i in order:
+        component = G.subgraph(components[i])
+        result = {'size': int(sizes[i])}
+        for metric in metrics:
+            if metric == 'degree':
+                result[metric] = (degree_centralization(component), 0.0)
+            elif metric == 'closeness':
+                result[metric] = closeness_centralization_with_error(component, sample_size, seed)
+            elif metric == 'betweenness':
+                result[metric] = betweenness_centralization_with_error(component, sample_size, seed)
+            else:
+                raise ValueError(f'Unknown centralization metric {metric}')
+        results.append(result)
+    return results
+
+
+def project_graph(G: ig.Graph, max_hub_degree: int = None, weights: str = None,
+                  chunk_size: int = projection_chunk_size) -> ig.Graph:
+    """
+    Projects G onto the vertices that share targets, the off-diagonal part of A @ A.T.
+    By default two vertices are joined once for every target they both have an edge to, as in A @ A.T.
+    The pairs are generated per target from its in-neighbour list, about chunk_size pairs at a time,
+    so the product is never built. Targets with more than max_hub_degree in-edges are left out, so hubs
+    do not turn into cliques. With weights='count' the result is a simple graph whose weight attribute
+    counts the shared targets. With weights='newman', each target adds 1 / (in-degree - 1) to every pair it joins.
+    """
+    if weights not in (None, 'count', 'newman'):
+        raise ValueError(f'Unknown projection weighting {weights}')
+
+    n = G.vcount()
+    edges = np.array(G.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    if not G.is_directed():
+        # both directions, like the symmetric adjacency matrix, with self-loops counted once
+        reverse = edges[edges[:, 0] != edges[:, 1]][:, ::-1]
+        edges = np.concatenate([edges, reverse])
+
+    # CSC layout: the sources of every target are contiguous, multi-edges repeat the source
+    sources = edges[np.argsort(edges[:, 1], kind='stable'), 0]
+    in_degree = np.bincount(edges[:, 1], minlength=n)
+    indptr = np.concatenate([[0], np.cumsum(in_degree)])
+    del edges
+
+    targets = np.flatnonzero(in_degree > 1)
+    if max_hub_degree is not None:
+        targets = targets[in_degree[targets] <= max_hub_degree]
+
+    # split the targets into chunks of about chunk_size pairs
+    cumulative_pairs = np.cumsum(in_degree[targets] * (in_degree[targets] - 1) // 2)
+    total_pairs = cumulative_pairs[-1] if len(targets) > 0 else 0
+    chunks = np.split(targets, np.searchsorted(cumulative_pairs, np.arange(chunk_size, total_pairs, chunk_size)))
+
+    key_parts, weight_parts = [], []
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        # every position in a target's source list is paired with the positions after it
+        degrees = in_degree[chunk]
+        offsets = np.cumsum(degrees) - degrees
+        positions = np.repeat(indptr[chunk] - offsets, degrees) + np.arange(degrees.sum())
+        ends = np.repeat(indptr[chunk + 1], degrees)
+        counts = ends - positions - 1
+        left = np.repeat(positions, counts)
+        group_starts = np.repeat(np.cumsum(counts) - counts, counts)
+        right = np.repeat(positions + 1, counts) + np.arange(len(left)) - group_starts
+
+        i, k = sources[left], sources[right]
+        keep = i != k
+        # each pair as a single int64 key, with the smaller vertex first
+        keys = np.minimum(i[keep], k[keep]) * n + np.maximum(i[keep], k[keep])
+
+        if weights is None:
+            key_parts.append(keys)
+            continue
+
+        if weights == 'count':
+            pair_weights = np.ones(len(keys))
+        else:
+            pair_weights = np.repeat(np.repeat(1 / (degrees - 1), degrees), counts)[keep]
+        keys, inverse = np.unique(keys, return_inverse=True)
+        key_parts.append(keys)
+        weight_parts.append(np.bincount(inverse, weights=pair_weights))
+
+    keys = np.concatenate(key_parts) if key_parts else np.empty(0, dtype=np.int64)
+    if weights is None:
+        # sorted keys give the edge order of the adjacency matrix
+        keys.sort()
+        edge_attrs = {}
+    else:
+        # pairs can be joined by targets in several chunks
+        keys, inverse = np.unique(keys, return_inverse=True)
+        pair_weights = np.concatenate(weight_parts) if weight_parts else np.empty(0)
+        edge_attrs = {'weight': np.bincount(inverse, weights=pair_weights, minlength=len(keys))}
+
+    edges = np.empty((len(keys), 2), dtype=np.int64)
+    np.floor_divide(keys, n, out=edges[:, 0])
+    np.remainder(keys, n, out=edges[:, 1])
+    return ig.Graph(n=n, edges=edges, directed=False, edge_attrs=edge_attrs)
     
 if __name__ == '__main__':
     pass
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import igraph as ig
+import numpy as np
+import pandas as pd
+
+from utils.file_utils import atomic_write
+from utils.graph_utils import graph_to_arrays, graph_from_arrays, degree_centralization, closeness_centralization_with_error, betweenness_centralization_with_error, \
+    centralization_sample_threshold, centralization_sample_size, centralization_sample_batches, centralization_seed
+
+# metric values are cached here, bump the version whenever a metric changes its output
+metrics_cache_path = '../data/cache/metrics/'
+metrics_cache_file = 'graph_metrics.pkl'
+metrics_cache_version = '2'
+
+# parameters that sampled centralizations depend on
+centralization_params = {
+    'threshold': centralization_sample_threshold,
+    'sample_size': centralization_sample_size,
+    'batches': centralization_sample_batches,
+    'seed': centralization_seed
+}
+
+
+def get_graph_fingerprint(g: ig.Graph) -> str:
+    # hash of the sorted edge list, so edge order does not matter, but vertex count and direction do
+    edges = np.array(g.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    if not g.is_directed():
+        edges = np.sort(edges, axis=1)
+    edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+
+    sha1 = hashlib.sha1()
+    sha1.update(f'{g.is_directed()}:{g.vcount()}:'.encode('utf-8'))
+    sha1.update(np.ascontiguousarray(edges).tobytes())
+    return sha1.hexdigest()
+
+
+class MetricsCache:
+    """
+    Metric values keyed on a graph fingerprint, the metric name and its parameters.
+    Values are read from cache_path once and written back by save(), which skips the write when nothing was set since.
+    A cache_path of None keeps them in memory only.
+    """
+
+    def __init__(self, cache_path: str = metrics_cache_path):
+        self.cache_path = cache_path
+        self.unsaved = 0
+        self.values = {}
+        if cache_path is not None and os.path.exists(os.path.join(cache_path, metrics_cache_file)):
+            with open(os.path.join(cache_path, metrics_cache_file), 'rb') as f:
+                self.values = pickle.load(f)
+
+    def key(self, fingerprint: str, metric: str, params: dict = None) -> tuple:
+        return (metrics_cache_version, fingerprint, metric, json.dumps(params, sort_keys=True))
+
+    def contains(self, fingerprint: str, metric: str, params: dict = None) -> bool:
+        return self.key(fingerprint, metric, params) in self.values
+
+    def get(self, fingerprint: str, metric: str, params: dict = None, default=None):
+        return self.values.get(self.key(fingerprint, metric, params), default)
+
+    def set(self, fingerprint: str, metric: str, value, params: dict = None) -> None:
+        self.values[self.key(fingerprint, metric, params)] = value
+        self.unsaved += 1
+
+    def save(self) -> None:
+        if self.cache_path is None or self.unsaved == 0:
+            return
+        with atomic_write(os.path.join(self.cache_path, metrics_cache_file)) as temporary, open(temporary, 'wb') as f:
+            pickle.dump(self.values, f)
+        self.unsaved = 0
+
+
+def get_graph_views(g: ig.Graph) -> dict:
+    # derived views that several metrics share, so each is computed once per graph
+    components = g.components(mode='weak')
+    return {
+        'components': components,
+        'lcc_size': max(components.sizes()) if g.vcount() > 0 else 0,
+        'simple': g.as_undirected().simplify() if g.vcount() > 2 else None
+    }
+
+
+# metrics of the metrics table, computed from a graph and its shared views
+table_metrics = {
+    'num_nodes': lambda g, views: g.vcount(),
+    'num_edges': lambda g, views: g.ecount(),
+    'num_self_loops': lambda g, views: sum(g.is_loop()),
+    'num_multi_edges': lambda g, views: sum(g.is_multiple()),
+    'num_components': lambda g, views: len(views['components']),
+    'num_nodes_in_lcc': lambda g, views: views['lcc_size'],
+    'density': lambda g, views: g.density(),
+    'diameter': lambda g, views: g.diameter(),
+    'diameter_un': lambda g, views: g.diameter(directed=False),
+    'avg_path_length': lambda g, views: g.average_path_length(),
+    'avg_path_length_un': lambda g, views: g.average_path_length(directed=False),
+    'degree_assortativty': lambda g, views: g.assortativity_degree(),
+    'clustering': lambda g, views: g.transitivity_undirected(mode='zero'),
+    'reciprocity': lambda g, views: g.reciprocity(),
+    'degree_centralization': lambda g, views: degree_centralization(views['simple']) if views['simple'] is not None else None,
+    # (value, error) tuples, which become a value and an error column in the table
+    'closeness_centralization': lambda g, views: closeness_centralization_with_error(views['simple']) if views['simple'] is not None else (None, None),
+    'betweenness_centralization': lambda g, views: betweenness_centralization_with_error(views['simple']) if views['simple'] is not None else (None, None)
+}
+
+table_metric_params = {
+    'closeness_centralization': centralization_params,
+    'betweenness_centralization': centralization_params
+}
+
+
+def graph_metrics(g: ig.Graph, metrics: list = None) -> dict:
+    views = get_graph_views(g)
+    return {metric: table_metrics[metric](g, views) for metric in (metrics or table_metrics)}
+
+
+def graph_metrics_from_arrays(task: tuple) -> dict:
+    # runs in a worker process, see get_metrics_table
+    arrays, metrics = task
+    return graph_metrics(graph_from_arrays(arrays), metrics)
+
+
+def get_metrics_table(graphs: list, workers: int = None, cache: MetricsCache = None, recompute: bool = False) -> pd.DataFrame:
+    """
+    Returns one row of metrics per graph. Metrics found in cache are not computed again, unless recompute is set.
+    With workers > 1 the graphs with missing metrics are sent to a process pool as edge and attribute arrays.
+    """
+    cache = cache if cache is not None else MetricsCache(None)
+    fingerprints = [get_graph_fingerprint(g) for g in graphs]
+    missing = [[metric for metric in table_metrics if recompute or not cache.contains(fingerprint, metric, table_metric_params.get(metric))]
+               for fingerprint in fingerprints]
+    todo = [i for i in range(len(graphs)) if len(missing[i]) > 0]
+
+    if workers is None or workers <= 1:
+        results = [graph_metrics(graphs[i], missing[i]) for i in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(graph_metrics_from_arrays, [(graph_to_arrays(graphs[i]), missing[i]) for i in todo]))
+
+    for i, values in zip(todo, results):
+        for metric, value in values.items():
+            cache.set(fingerprints[i], metric, value, table_metric_params.get(metric))
+    if len(todo) > 0:
+        cache.save()
+
+    rows = []
+    for g, fingerprint in zip(graphs, fingerprints):
+        row = {'hashtag': g['name'], 'category': g['category']}
+        for metric in table_metrics:
+            value = cache.get(fingerprint, metric, table_metric_params.get(metric))
+            if isinstance(value, tuple):
+                row[metric], row[f'{metric}_error'] = value
+            else:
+                row[metric] = value
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def load_metrics_table(graphs: list, workers: int = None, recompute: bool = False, cache_path: str = metrics_cache_path) -> pd.DataFrame:
+    """
+    Returns the metrics table of graphs, computing only the metrics of graphs that are not in the cache in cache_path.
+    """
+    return get_metrics_table(graphs, workers, MetricsCache(cache_path), recompute)
@@ -0,0 +1,465 @@
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import igraph as ig
+import numpy as np
+
+from utils.null_model_utils import EdgeSwapRewirer, graph_to_edge_arrays
+
+# number of target graphs a single task matches a motif against
+occurrence_chunk_size = 16
+
+# largest degrees per sequence the prefilter compares, as many as the largest mined motifs have vertices
+invariant_degrees = 12
+
+# null models generated and matched per task, and the seed they are derived from
+null_model_batch_size = 10
+null_model_seed = 0
+
+# target graphs of the current worker process, see init_worker
+worker_targets = None
+
+# motifs the current worker process counts in null models, their canonical forms, the engine matching them
+# and the specs of the null model graphs, see init_null_model_worker
+worker_null_motifs = None
+worker_null_forms = None
+worker_null_engine = None
+worker_null_model_specs = None
+
+
+def graph_to_match_arrays(g: ig.Graph, edge_color: str = None) -> dict:
+    # only what subisomorphic_vf2 needs, the structure and the edge colors
+    return {
+        'directed': g.is_directed(),
+        'n': g.vcount(),
+        'edges': np.array(g.get_edgelist(), dtype=np.int64).reshape(-1, 2),
+        'edge_colors': g.es[edge_color] if edge_color is not None else None
+    }
+
+
+def graph_from_match_arrays(arrays: dict) -> ig.Graph:
+    g = ig.Graph(n=arrays['n'], edges=arrays['edges'], directed=arrays['directed'])
+    if arrays['edge_colors'] is not None:
+        g.es['color'] = arrays['edge_colors']
+    return g
+
+
+def largest_degrees(degrees: np.ndarray) -> np.ndarray:
+    # the invariant_degrees largest degrees in decreasing order, padded with zeros
+    if len(degrees) > invariant_degrees:
+        degrees = np.partition(degrees, len(degrees) - invariant_degrees)[len(degrees) - invariant_degrees:]
+    return np.pad(np.sort(degrees)[::-1], (0, max(invariant_degrees - len(degrees), 0)))
+
+
+def get_graph_invariants(arrays: dict) -> dict:
+    """
+    Invariants of the graph with the match arrays of graph_to_match_arrays that can only shrink when taking a subgraph:
+    the largest degrees of the degree sequences, see largest_degrees, and the number of edges of each color.
+    """
+    out_degrees = np.bincount(arrays['edges'][:, 0], minlength=arrays['n'])
+    in_degrees = np.bincount(arrays['edges'][:, 1], minlength=arrays['n'])
+    invariants = {
+        'n': arrays['n'],
+        'degrees': largest_degrees(out_degrees + in_degrees),
+        'colors': Counter(arrays['edge_colors']) if arrays['edge_colors'] is not None else None
+    }
+    if arrays['directed']:
+        invariants['in_degrees'] = largest_degrees(in_degrees)
+        invariants['out_degrees'] = largest_degrees(out_degrees)
+    return invariants
+
+
+def stack_invariants(invariants: list) -> dict:
+    # the invariants of a list of targets as arrays with a row per target, so a motif is checked against all of them at once
+    stacked = {'n': np.array([target['n'] for target in invariants], dtype=np.int64), 'colors': None}
+    for key in ('degrees', 'in_degrees', 'out_degrees'):
+        if all(key in target for target in invariants):
+            stacked[key] = np.array([target[key] for target in invariants]).reshape(len(invariants), invariant_degrees)
+    if invariants and all(target['colors'] is not None for target in invariants):
+        stacked['colors'] = {color: np.array([target['colors'][color] for target in invariants])
+                             for color in set().union(*(target['colors'] for target in invariants))}
+    return stacked
+
+
+def can_contain(targets: dict, motif: dict) -> np.ndarray:
+    """
+    Mask of the targets of stack_invariants that may contain the motif. VF2 can be skipped for the others.
+    The k largest target degrees have to cover the k motif degrees one by one, and colors are only compared
+    when both invariants have them.
+    """
+    mask = targets['n'] >= motif['n']
+    for key in ('degrees', 'in_degrees', 'out_degrees'):
+        if key in motif and key in targets:
+            mask &= np.all(targets[key] >= motif[key], axis=1)
+    if motif['colors'] is not None and targets['colors'] is not None:
+        for color, count in motif['colors'].items():
+            mask &= targets['colors'][color] >= count if color in targets['colors'] else False
+    return mask
+
+
+def lattice_signatures(motif: ig.Graph, edge_color: str = None) -> tuple:
+    """
+    Returns the signature of motif, its sorted vertex degrees (in and out degrees when directed) and edge colors,
+    and the set of signatures a motif with one edge less that motif contains can have: motif without one of its
+    edges, and without any number of the vertices that leaves isolated.
+    """
+    directed = motif.is_directed()
+    edges = motif.get_edgelist()
+    edge_colors = motif.es[edge_color] if edge_color is not None else [None] * len(edges)
+    out_degrees, in_degrees = [0] * motif.vcount(), [0] * motif.vcount()
+    for u, v in edges:
+        out_degrees[u] += 1
+        in_degrees[v] += 1
+
+    def signature(out_degrees: list, in_degrees: list, edge_colors: list) -> tuple:
+        degrees = zip(in_degrees, out_degrees) if directed else map(sum, zip(in_degrees, out_degrees))
+        return directed, tuple(sorted(degrees)), tuple(sorted(edge_colors, key=str))
+
+    sub_signatures = set()
+    for k, (u, v) in enumerate(edges):
+        sub_out_degrees, sub_in_degrees = out_degrees.copy(), in_degrees.copy()
+        sub_out_degrees[u] -= 1
+        sub_in_degrees[v] -= 1
+        sub_directed, degrees, colors = signature(sub_out_degrees, sub_in_degrees, edge_colors[:k] + edge_colors[k + 1:])
+        # isolated vertices sort first
+        isolated = sum(1 for degree in degrees if degree in ((0, 0), 0))
+        sub_signatures.update((sub_directed, degrees[i:], colors) for i in range(isolated + 1))
+    return signature(out_degrees, in_degrees, edge_colors), sub_signatures
+
+
+def get_canonical_form(motif: ig.Graph, edge_color: str = None) -> tuple:
+    """
+    Hashable form that is equal for two motifs exactly when they are isomorphic, edge colors included.
+    Colored edges are subdivided by a vertex carrying the color, so that bliss only needs vertex colors.
+    """
+    n, edges = motif.vcount(), motif.get_edgelist()
+    edge_colors = motif.es[edge_color] if edge_color is not None else [None] * len(edges)
+    palette = {color: i + 1 for i, color in enumerate(sorted(set(edge_colors), key=str))}
+
+    subdivided = ig.Graph(n + len(edges), [e for k, (u, v) in enumerate(edges) for e in ((u, n + k), (n + k, v))], directed=motif.is_directed())
+    subdivided.vs['color'] = [None] * n + edge_colors
+    # canonical_permutation is meant for permute_vertices. Mapping every vertex u to permutation[u] by hand applies the inverse,
+    # which gave isomorphic motifs different forms and so different memo keys
+    canonical = subdivided.permute_vertices(subdivided.canonical_permutation(color=[0] * n + [palette[color] for color in edge_colors]))
+    # the stored orientation of an undirected edge is arbitrary, so its endpoints are sorted
+    canonical_edges = sorted(edge if motif.is_directed() else tuple(sorted(edge)) for edge in canonical.get_edgelist())
+    return (motif.is_directed(), n, tuple(canonical_edges), tuple(canonical.vs['color']))
+
+
+def init_worker(target_arrays: dict) -> None:
+    global worker_targets
+    worker_targets = {name: [graph_from_match_arrays(arrays) for arrays in graphs] for name, graphs in target_arrays.items()}
+
+
+def match_chunk(task: tuple, targets: dict = None) -> list:
+    # runs in a worker process on worker_targets, or in the main process on the engine's own targets
+    motif_arrays, target_set, indices = task
+    targets = targets if targets is not None else worker_targets
+    motif = graph_from_match_arrays(motif_arrays)
+    motif_color = 'color' if motif_arrays['edge_colors'] is not None else None
+    occurrences = []
+    for g in [targets[target_set][i] for i in indices]:
+        # colors are only compared when both sides have them
+        use_colors = motif_color is not None and 'color' in g.es.attributes()
+        occurrences.append(g.subisomorphic_vf2(motif, edge_color1='color' if use_colors else None, edge_color2=motif_color if use_colors else None))
+    return occurrences
+
+
+class MotifOccurrenceEngine:
+    """
+    Finds which target graphs contain each motif, with subisomorphic_vf2.
+    targets maps a target set name to a list of graphs and the edge attribute holding their colors, or None
+    for uncolored matching. With workers > 1 the targets are sent to each worker process once, and the
+    (motif, chunk of targets) pairs are spread over the pool. Use as a context manager to shut the pool down.
+    With prefilter, pairs ruled out by the invariants of get_graph_invariants are never sent to VF2. It is off by default,
+    since after memoization it skips too few pairs on the mined patterns to pay for itself, see the motifs benchmark.
+    With memoize, results are kept per target and canonical motif form, and reused along the motif lattice:
+    a target missing a sub-pattern misses the motif, and a target containing a super-pattern contains it.
+    pairs counts the (motif, target) pairs seen so far, skipped those ruled out by invariants and inferred
+    those answered from earlier results. A serial engine can be pointed at new targets with set_targets.
+    """
+
+    def __init__(self, targets: dict, workers: int = None, chunk_size: int = occurrence_chunk_size, prefilter: bool = False, memoize: bool = True):
+        self.chunk_size = chunk_size
+        self.prefilter = prefilter
+        self.memoize = memoize
+        self.pairs = 0
+        self.skipped = 0
+        self.inferred = 0
+
+        # the motif lattice over canonical forms and the invariants of each form, which do not depend on the targets
+        self.lattice_motifs = {}
+        self.lattice_buckets = {}
+        self.lattice_super_buckets = {}
+        self.sub_patterns = {}
+        self.super_patterns = {}
+        self.motif_invariants = {}
+
+        self.executor = None
+        self.local_targets = None
+        target_arrays = self.load_targets(targets)
+        if workers is not None and workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(target_arrays,))
+        else:
+            # kept on the engine, so that engines in the same process do not share targets
+            self.local_targets = {name: [graph_from_match_arrays(arrays) for arrays in graphs] for name, graphs in target_arrays.items()}
+
+    def load_targets(self, targets: dict) -> dict:
+        # sizes, colors and invariants of the targets, and their match arrays
+        self.target_sizes = {name: len(graphs) for name, (graphs, _) in targets.items()}
+        self.target_colored = {name: edge_color is not None for name, (_, edge_color) in targets.items()}
+        target_arrays = {name: [graph_to_match_arrays(g, edge_color) for g in graphs] for name, (graphs, edge_color) in targets.items()}
+        # built once per target graph, in the main process
+        self.target_invariants = {}
+        if self.prefilter:
+            self.target_invariants = {name: stack_invariants([get_graph_invariants(arrays) for arrays in graphs]) for name, graphs in target_arrays.items()}
+        # (target set, target index, canonical form) -> contained
+        self.contained = {}
+        return target_arrays
+
+    def set_targets(self, targets: dict) -> None:
+        """
+        Replaces the targets of a serial engine, dropping the containment results of the old ones.
+        The motif lattice, forms and invariants are kept, so motifs seen before are not prepared again.
+        """
+        if self.executor is not None:
+            raise ValueError('The targets of an engine with workers are fixed, use a new engine')
+        target_arrays = self.load_targets(targets)
+        self.local_targets = {name: [graph_from_match_arrays(arrays) for arrays in graphs] for name, graphs in target_arrays.items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def skip_rate(self) -> float:
+        return (self.skipped + self.inferred) / self.pairs if self.pairs > 0 else 0.0
+
+    def candidates(self, motif: ig.Graph, motif_edge_color: str, name: str, form: tuple) -> list:
+        # indices of the targets in name that may contain motif, whose invariants are computed once per form
+        if not self.prefilter:
+            return list(range(self.target_sizes[name]))
+        color = motif_edge_color if self.target_colored[name] else None
+        if (form, color is not None) not in self.motif_invariants:
+            self.motif_invariants[(form, color is not None)] = get_graph_invariants(graph_to_match_arrays(motif, color))
+        motif_invariants = self.motif_invariants[(form, color is not None)]
+        return np.flatnonzero(can_contain(self.target_invariants[name], motif_invariants)).tolist()
+
+    def add_to_lattice(self, form: tuple, motif: ig.Graph, motif_edge_color: str) -> None:
+        """
+        Links form to the known forms with one edge less that it contains, and the ones with one edge more that contain it.
+        Only motifs that are both colored or both uncolored are linked, since their containment is checked the same way.
+        Forms are bucketed by their lattice_signatures, so VF2 only compares forms whose degrees and colors already fit.
+        """
+        if form in self.lattice_motifs:
+            return
+        match_motif = graph_from_match_arrays(graph_to_match_arrays(motif, motif_edge_color))
+        colored = motif_edge_color is not None
+        self.lattice_motifs[form] = (match_motif, colored)
+        self.sub_patterns[form] = set()
+        self.super_patterns[form] = set()
+
+        signature, sub_signatures = lattice_signatures(match_motif, 'color' if colored else None)
+        self.lattice_buckets.setdefault((colored, signature), []).append(form)
+        for sub_signature in sub_signatures:
+            self.lattice_super_buckets.setdefault((colored, sub_signature), []).append(form)
+
+        color = 'color' if colored else None
+        for other in [other for sub_signature in sub_signatures for other in self.lattice_buckets.get((colored, sub_signature), [])]:
+            if match_motif.subisomorphic_vf2(self.lattice_motifs[other][0], edge_color1=color, edge_color2=color):
+                self.sub_patterns[form].add(other)
+                self.super_patterns[other].add(form)
+        for other in self.lattice_super_buckets.get((colored, signature), []):
+            if other != form and self.lattice_motifs[other][0].subisomorphic_vf2(match_motif, edge_color1=color, edge_color2=color):
+                self.super_patterns[form].add(other)
+                self.sub_patterns[other].add(form)
+
+    def infer(self, name: str, index: int, form: tuple):
+        # True or False when results of sub- or super-patterns decide containment, None when VF2 is needed
+        if any(self.contained.get((name, index, sub_pattern)) is False for sub_pattern in self.sub_patterns[form]):
+            return False
+        if any(self.contained.get((name, index, super_pattern)) is True for super_pattern in self.super_patterns[form]):
+            return True
+        return None
+
+    def prepare(self, motifs: list, motif_edge_color: str = None) -> list:
+        """
+        Returns the forms of motifs, see get_canonical_form, after adding them to the motif lattice.
+        Pass them to occurrences to match the same motifs against several targets without preparing them again.
+        """
+        colors = [motif_edge_color if motif_edge_color in motif.es.attributes() else None for motif in motifs]
+        if self.memoize:
+            forms = [get_canonical_form(motif, color) for motif, color in zip(motifs, colors)]
+            for form, motif, color in zip(forms, motifs, colors):
+                self.add_to_lattice(form, motif, color)
+        else:
+            # without memoization every motif is its own form, and nothing is shared between motifs
+            forms = [('motif', i) for i in range(len(motifs))]
+            self.sub_patterns = {form: set() for form in forms}
+            self.super_patterns = {form: set() for form in forms}
+            self.motif_invariants = {}
+        return forms
+
+    def occurrences(self, motifs: list, motif_edge_color: str = None, forms: list = None) -> list:
+        """
+        Returns one dict per motif, mapping every target set name to a list with a bool per target graph.
+        Colors are compared when motif_edge_color is given and the target set has colors.
+        Motifs are matched in order of increasing size, so that what a motif misses rules out its super-patterns.
+        forms, if given, are the forms prepare returned for the same motifs and motif_edge_color.
+        """
+        colors = [motif_edge_color if motif_edge_color in motif.es.attributes() else None for motif in motifs]
+        if forms is None:
+            forms = self.prepare(motifs, motif_edge_color)
+        if not self.memoize:
+            self.contained = {}
+
+        for size in sorted(set(motif.ecount() for motif in motifs)):
+            tasks = []
+            for i in [i for i, motif in enumerate(motifs) if motif.ecount() == size]:
+                motif_arrays = graph_to_match_arrays(motifs[i], colors[i])
+                for name, target_size in self.target_sizes.items():
+                    self.pairs += target_size
+                    candidates = set(self.candidates(motifs[i], colors[i], name, forms[i]))
+                    todo = []
+                    for index in range(target_size):
+                        key = (name, index, forms[i])
+                        if key in self.contained:
+                            # matched earlier, or pending for a duplicate of this motif in this level
+                            self.inferred += 1
+                            continue
+                        known = self.infer(name, index, forms[i])
+                        if known is not None:
+                            self.inferred += 1
+                            self.contained[key] = known
+                        elif index not in candidates:
+                            # ruled out by invariants, which its super-patterns inherit
+                            self.skipped += 1
+                            self.contained[key] = False
+                        else:
+                            todo.append(index)
+                            self.contained[key] = None
+                    for start in range(0, len(todo), self.chunk_size):
+                        tasks.append((forms[i], name, (motif_arrays, name, todo[start:start + self.chunk_size])))
+
+            # a level has to finish before the next one can build on its results
+            if self.executor is not None:
+                chunks = self.executor.map(match_chunk, [task for _, _, task in tasks])
+            else:
+                chunks = [match_chunk(task, self.local_targets) for _, _, task in tasks]
+            for (form, name, (_, _, indices)), chunk in zip(tasks, chunks):
+                for index, occurrence in zip(indices, chunk):
+                    self.contained[(name, index, form)] = occurrence
+
+        return [{name: [self.contained[(name, index, form)] for index in range(target_size)] for name, target_size in self.target_sizes.items()} for form in forms]
+
+
+def get_null_model_spec(g: ig.Graph, model: str):
+    # all a null model of g depends on, sent to each worker once
+    if model == 'configuration':
+        return (g.degree(mode='in'), g.degree(mode='out'))
+    elif model == 'erdos_renyi':
+        return (g.vcount(), g.ecount())
+    elif model == 'edge_swap':
+        return graph_to_edge_arrays(g)
+    raise ValueError(f'Unknown null model {model}, use configuration, erdos_renyi or edge_swap')
+
+
+def generate_null_model(model: str, spec: tuple, seed: str, undirected: bool = False) -> ig.Graph:
+    """
+    Returns the null model of the graph with spec, seeded so that the same seed always gives the same graph.
+    These are the simplified configuration and Erdos-Renyi models fsm.py compares motifs against.
+    """
+    ig.set_random_number_generator(random.Random(seed))
+    try:
+        if model == 'configuration':
+            g = ig.Graph.Degree_Sequence(spec[0], spec[1]).simplify()
+        else:
+            g = ig.Graph.Erdos_Renyi(n=spec[0], m=spec[1], directed=True).simplify(multiple=False)
+    finally:
+        ig.set_random_number_generator(random)
+    return g.as_undirected(mode='each') if undirected else g
+
+
+def get_null_model_tasks(graphs: list, model: str, bootstraps: int, seed: int = null_model_seed, batch_size: int = null_model_batch_size) -> list:
+    """
+    Splits the null models of graphs into tasks of (graph index, seed) items, independent of the number of workers.
+    Generated models get a seed per (graph, bootstrap) and batch_size of them per task. Edge swap models of
+    a graph are successive samples of one rewiring chain, so a task holds the chain of a single graph.
+    """
+    if model == 'edge_swap':
+        return [[(i, [seed, i])] for i in range(len(graphs))]
+    seeds = [(i, f'{seed}:{model}:{i}:{b}') for i in range(len(graphs)) for b in range(bootstraps)]
+    return [seeds[start:start + batch_size] for start in range(0, len(seeds), batch_size)]
+
+
+def iter_task_null_models(model: str, task: list, specs: list, bootstraps: int, batch_size: int, undirected: bool):
+    # yields the null models of a task in batches of at most batch_size
+    if model != 'edge_swap':
+        for start in range(0, len(task), batch_size):
+            yield [generate_null_model(model, specs[i], graph_seed, undirected) for i, graph_seed in task[start:start + batch_size]]
+        return
+    for i, chain_seed in task:
+        rewirer = EdgeSwapRewirer(specs[i], seed=chain_seed)
+        for start in range(0, bootstraps, batch_size):
+            batch = [rewirer.sample() for _ in range(min(batch_size, bootstraps - start))]
+            yield [g.as_undirected(mode='each') for g in batch] if undirected else batch
+
+
+def iter_null_models(graphs: list, model: str, bootstraps: int, seed: int = null_model_seed, batch_size: int = null_model_batch_size, undirected: bool = False):
+    """
+    Yields the bootstraps null models of every graph in batches of at most batch_size, in the order of graphs.
+    Only one batch is held in memory at a time.
+    """
+    specs = [get_null_model_spec(g, model) for g in graphs]
+    for task in get_null_model_tasks(graphs, model, bootstraps, seed, batch_size):
+        yield from iter_task_null_models(model, task, specs, bootstraps, batch_size, undirected)
+
+
+def init_null_model_worker(motif_arrays: list, specs: list) -> None:
+    global worker_null_motifs, worker_null_forms, worker_null_engine, worker_null_model_specs
+    worker_null_motifs = [graph_from_match_arrays(arrays) for arrays in motif_arrays]
+    # a serial engine whose motif lattice is built once, and whose targets are the batch being counted
+    worker_null_engine = MotifOccurrenceEngine({})
+    worker_null_forms = worker_null_engine.prepare(worker_null_motifs)
+    worker_null_model_specs = specs
+
+
+def count_null_model_task(task: tuple) -> list:
+    # runs in a worker process, or in the main process when counting serially
+    model, items, bootstraps, batch_size, undirected = task
+    counts = np.zeros(len(worker_null_motifs), dtype=np.int64)
+    for null_models in iter_task_null_models(model, items, worker_null_model_specs, bootstraps, batch_size, undirected):
+        # the invariants and the motif lattice prune the batch like any other target set
+        worker_null_engine.set_targets({'null_models': (null_models, None)})
+        occurrences = worker_null_engine.occurrences(worker_null_motifs, forms=worker_null_forms)
+        counts += [sum(motif_occurrences['null_models']) for motif_occurrences in occurrences]
+    return counts
+
+
+def count_null_model_occurrences(motifs: list, graphs: list, model: str, bootstraps: int, seed: int = null_model_seed, batch_size: int = null_model_batch_size,
+                                 workers: int = None, undirected: bool = False) -> list:
+    """
+    Returns for every motif the number of null models it occurs in, out of the bootstraps null models of every graph.
+    Null models are generated from their seeds in the process that matches them, one batch at a time,
+    so memory use does not grow with bootstraps. Motifs are matched without edge colors.
+    """
+    tasks = [(model, items, bootstraps, batch_size, undirected) for items in get_null_model_tasks(graphs, model, bootstraps, seed, batch_size)]
+    initargs = ([graph_to_match_arrays(motif) for motif in motifs], [get_null_model_spec(g, model) for g in graphs])
+
+    counts = np.zeros(len(motifs), dtype=np.int64)
+    if workers is not None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_null_model_worker, initargs=initargs) as executor:
+            for task_counts in executor.map(count_null_model_task, tasks):
+                counts += task_counts
+    else:
+        init_null_model_worker(*initargs)
+        for task in tasks:
+            counts += count_null_model_task(task)
+    return counts.tolist()
@@ -0,0 +1,101 @@
+import igraph as ig
+import numpy as np
+
+# attempted swaps per edge before the first sample, and between two samples
+edge_swap_burn_in = 10
+edge_swap_interval = 2
+
+
+class EdgeSwapRewirer:
+    """
+    Rewires a working copy of a graph without multi-edges with double-edge swaps, which keep every (in and out) degree exactly.
+    Edges live in NumPy arrays and swaps are proposed in batches of disjoint edge pairs, drawn from a random
+    permutation of the edges, so a batch is applied at once. Swaps that would create a self loop or a multi-edge are rejected.
+    Construct from a graph, or from the arrays of graph_to_edge_arrays, and call sample() for each snapshot.
+    """
+
+    def __init__(self, g, seed=None, burn_in: float = edge_swap_burn_in, interval: float = edge_swap_interval):
+        arrays = graph_to_edge_arrays(g) if isinstance(g, ig.Graph) else g
+        self.n = arrays['n']
+        self.directed = arrays['directed']
+        # self loops stay where they are, only the other edges are swapped
+        loops = arrays['edges'][:, 0] == arrays['edges'][:, 1]
+        self.loops = arrays['edges'][loops]
+        self.sources = arrays['edges'][~loops, 0].copy()
+        self.targets = arrays['edges'][~loops, 1].copy()
+        self.rng = np.random.default_rng(seed)
+        self.burn_in = burn_in
+        self.interval = interval
+        self.burnt_in = False
+        self.accepted = 0
+        self.proposed = 0
+
+        if len(np.unique(self.keys(self.sources, self.targets))) < len(self.sources):
+            raise ValueError('Graph must not have multi-edges, call simplify(loops=False) first')
+
+    def keys(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        # one integer per edge, the same for both directions of an undirected edge
+        if not self.directed:
+            sources, targets = np.minimum(sources, targets), np.maximum(sources, targets)
+        return sources.astype(np.int64) * self.n + targets
+
+    def swap_batch(self, size: int) -> None:
+        # size disjoint pairs of edges, at most half the number of edges
+        edges = self.rng.permutation(len(self.sources))[:2 * size]
+        first, second = edges[:size], edges[size:]
+        self.proposed += size
+
+        a, b = self.sources[first], self.targets[first]
+        c, d = self.sources[second], self.targets[second]
+        if not self.directed:
+            # an undirected pair can be swapped in two ways, pick one by orienting the second edge at random
+            flip = self.rng.random(len(first)) < 0.5
+            c, d = np.where(flip, d, c), np.where(flip, c, d)
+
+        # (a, b), (c, d) -> (a, d), (c, b), without self loops, existing edges or duplicates within the batch
+        new_first, new_second = self.keys(a, d), self.keys(c, b)
+        existing = np.sort(self.keys(self.sources, self.targets))
+        valid = (a != d) & (c != b) & (new_first != new_second) & ~sorted_contains(existing, new_first) & ~sorted_contains(existing, new_second)
+        new_keys, counts = np.unique(np.concatenate([new_first[valid], new_second[valid]]), return_counts=True)
+        valid &= ~np.isin(new_first, new_keys[counts > 1]) & ~np.isin(new_second, new_keys[counts > 1])
+
+        self.sources[first[valid]], self.targets[first[valid]] = a[valid], d[valid]
+        self.sources[second[valid]], self.targets[second[valid]] = c[valid], b[valid]
+        self.accepted += int(np.sum(valid))
+
+    def swap(self, swaps: int) -> None:
+        # swaps attempted double-edge swaps, in batches
+        if len(self.sources) < 2:
+            return
+        batch_size = len(self.sources) // 2
+        for start in range(0, swaps, batch_size):
+            self.swap_batch(min(batch_size, swaps - start))
+
+    def edges(self) -> np.ndarray:
+        return np.concatenate([np.column_stack([self.sources, self.targets]), self.loops])
+
+    def sample(self) -> ig.Graph:
+        """
+        Rewires the working copy further, by burn_in swaps per edge the first time and interval swaps per edge after that,
+        and returns a snapshot of it as a new graph.
+        """
+        self.swap(int((self.interval if self.burnt_in else self.burn_in) * len(self.sources)))
+        self.burnt_in = True
+        return ig.Graph(n=self.n, edges=self.edges(), directed=self.directed)
+
+    def samples(self, count: int):
+        for _ in range(count):
+            yield self.sample()
+
+
+def sorted_contains(sorted_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+    positions = np.minimum(np.searchsorted(sorted_values, values), max(len(sorted_values) - 1, 0))
+    return sorted_values[positions] == values if len(sorted_values) > 0 else np.zeros(len(values), dtype=bool)
+
+
+def graph_to_edge_arrays(g: ig.Graph) -> dict:
+    return {
+        'n': g.vcount(),
+        'directed': g.is_directed(),
+        'edges': np.array(g.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    }
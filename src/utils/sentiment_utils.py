@@ -0,0 +1,145 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+from utils.file_utils import atomic_write
+
+# scores are cached here, keyed on the sha1 of the scored text, in shard files that each hold the scores of one run
+sentiment_cache_path = '../data/cache/sentiment/'
+sentiment_cache_prefix = 'vader_scores'
+sentiment_cache_schema = pa.schema([
+    ('hash', pa.binary(20)),
+    ('neg', pa.float64()),
+    ('neu', pa.float64()),
+    ('pos', pa.float64()),
+    ('compound', pa.float64())
+])
+
+# shards are merged into one once there are more than this many
+sentiment_cache_max_shards = 32
+
+# analyzer of the current worker process, see init_worker
+analyzer = None
+
+
+def compound_to_label(compound: float) -> str:
+    if compound > 0.05:
+        return 'positive'
+    elif compound < -0.05:
+        return 'negative'
+    return 'neutral'
+
+
+def get_text_hash(text: str) -> bytes:
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+def get_cache_shards(cache_path: str) -> list:
+    if not os.path.isdir(cache_path):
+        return []
+    return sorted(os.path.join(cache_path, file) for file in os.listdir(cache_path) if file.startswith(sentiment_cache_prefix) and file.endswith('.arrow'))
+
+
+def read_cache_shard(shard: str, hashes: list = None) -> pa.Table:
+    with pa.memory_map(shard, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    if hashes is not None:
+        table = table.filter(pc.is_in(table['hash'], value_set=pa.array(hashes, type=pa.binary(20))))
+    return table
+
+
+def write_cache_shard(table: pa.Table, cache_path: str) -> str:
+    # shards are named after their content
+    name = hashlib.sha1(b''.join(table['hash'].to_pylist())).hexdigest()
+    shard = os.path.join(cache_path, f'{sentiment_cache_prefix}_{name}.arrow')
+    with atomic_write(shard) as temporary, pa.OSFile(temporary, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return shard
+
+
+def load_sentiment_cache(cache_path: str = sentiment_cache_path, hashes: list = None) -> dict:
+    """
+    Returns the cached scores keyed on text hash, only of hashes if given. Shards are filtered in Arrow,
+    so only the requested rows become Python objects.
+    """
+    cache = {}
+    for shard in get_cache_shards(cache_path):
+        table = read_cache_shard(shard, hashes)
+        columns = [table[column].to_pylist() for column in sentiment_cache_schema.names]
+        cache.update((row[0], dict(zip(['neg', 'neu', 'pos', 'compound'], row[1:]))) for row in zip(*columns))
+    return cache
+
+
+def save_sentiment_cache(cache: dict, cache_path: str = sentiment_cache_path) -> None:
+    """
+    Adds the scores in cache as a new shard, without rewriting the existing ones.
+    Once there are more than sentiment_cache_max_shards shards, they are merged into one.
+    """
+    hashes = list(cache.keys())
+    table = pa.table({
+        'hash': hashes,
+        'neg': [cache[h]['neg'] for h in hashes],
+        'neu': [cache[h]['neu'] for h in hashes],
+        'pos': [cache[h]['pos'] for h in hashes],
+        'compound': [cache[h]['compound'] for h in hashes]
+    }, schema=sentiment_cache_schema)
+    write_cache_shard(table, cache_path)
+
+    shards = get_cache_shards(cache_path)
+    if len(shards) > sentiment_cache_max_shards:
+        merged = write_cache_shard(pa.concat_tables([read_cache_shard(shard) for shard in shards]), cache_path)
+        for shard in shards:
+            if shard != merged:
+                os.remove(shard)
+
+
+def init_worker() -> None:
+    global analyzer
+    analyzer = SentimentIntensityAnalyzer()
+
+
+def score_chunk(texts: list) -> list:
+    # runs in a worker process, or in the main process when scoring serially
+    if analyzer is None:
+        init_worker()
+    return [analyzer.polarity_scores(text) for text in texts]
+
+
+def score_texts(texts, workers: int = None, chunk_size: int = 1000, cache_path: str = sentiment_cache_path) -> list:
+    """
+    Returns the VADER polarity scores of every text, or None where the text is None.
+    Identical texts are scored once, and texts scored in earlier runs are read from the cache in cache_path.
+    Remaining texts are scored in chunks of chunk_size, in a process pool when workers > 1.
+    Set cache_path to None to disable the cache.
+    """
+    texts = list(texts)
+    hashes = [get_text_hash(text) if text is not None else None for text in texts]
+    unique_hashes = list(set(text_hash for text_hash in hashes if text_hash is not None))
+    cache = load_sentiment_cache(cache_path, unique_hashes) if cache_path is not None else {}
+
+    # unique texts that have not been scored before
+    missing = {}
+    for text, text_hash in zip(texts, hashes):
+        if text_hash is not None and text_hash not in cache:
+            missing[text_hash] = text
+
+    if len(missing) > 0:
+        missing_texts = list(missing.values())
+        chunks = [missing_texts[i:i + chunk_size] for i in range(0, len(missing_texts), chunk_size)]
+        if workers is None or workers <= 1:
+            scores = [score for chunk in chunks for score in score_chunk(chunk)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+                scores = [score for chunk_scores in executor.map(score_chunk, chunks) for score in chunk_scores]
+        new_scores = dict(zip(missing.keys(), scores))
+        cache.update(new_scores)
+        if cache_path is not None:
+            save_sentiment_cache(new_scores, cache_path)
+
+    # copies, so callers can modify the returned scores freely
+    return [dict(cache[text_hash]) if text_hash is not None else None for text_hash in hashes]